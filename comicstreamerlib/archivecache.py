@@ -0,0 +1,125 @@
+# coding=utf-8
+
+"""
+ComicStreamer open comic archive cache class
+"""
+
+"""
+Copyright 2012-2014  Anthony Beville
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+	http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+class ComicArchiveCache():
+    """
+    Keeps recently used ComicArchive objects, with their page lists and
+    whatever else they've read already, so the next page of the same
+    comic doesn't start from scratch.
+
+    Entries are keyed by path, and only used while the file's mtime and
+    size are the same as when it was opened, so a replaced file never
+    gets a stale page list.  The cache is bounded both by count and by a
+    rough estimate of the memory each archive holds on to.
+    """
+
+    def __init__(self, max_count, max_size):
+        self.max_count = max_count
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # path -> [stamp, archive, size], oldest first
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, create):
+        # returns the archive for path, calling create() to make a new one
+        # if there isn't a current one
+        try:
+            st = os.stat(path)
+            stamp = (st.st_mtime, st.st_size)
+        except OSError:
+            stamp = None
+
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                if entry[0] == stamp and stamp is not None:
+                    # the archive may have read more since it went in
+                    self.current_size -= entry[2]
+                    entry[2] = self.estimateSize(entry[1])
+                    self.current_size += entry[2]
+                    self.entries[path] = entry
+                    self.hits += 1
+                    return entry[1]
+                self.current_size -= entry[2]
+            self.misses += 1
+
+        # opening the archive may take a while, so not under the lock
+        ca = create()
+        if stamp is None:
+            return ca
+
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.current_size -= old[2]
+            size = self.estimateSize(ca)
+            self.entries[path] = [stamp, ca, size]
+            self.current_size += size
+            self.evict()
+        return ca
+
+    def invalidate(self, path):
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.current_size -= entry[2]
+
+    def stats(self):
+        with self.lock:
+            return { 'entries': len(self.entries),
+                     'size': self.current_size,
+                     'max_count': self.max_count,
+                     'max_size': self.max_size,
+                     'hits': self.hits,
+                     'misses': self.misses,
+                     'evictions': self.evictions,
+                   }
+
+    def estimateSize(self, ca):
+        # ballpark bytes held by the archive: the object itself, its page
+        # list, any member offsets, and any metadata it has parsed
+        size = 2048
+        if ca.page_list is not None:
+            size += sum(len(name) + 64 for name in ca.page_list)
+        member_info = getattr(ca.archiver, "member_info", None)
+        if member_info is not None:
+            size += len(member_info) * 160
+        for md in [ca.cix_md, ca.cbi_md, ca.comet_md]:
+            if md is not None:
+                size += 4096
+        return size
+
+    # expects the lock to be held
+    def evict(self):
+        # never the newest entry, which is about to be used
+        while len(self.entries) > 1 and (len(self.entries) > self.max_count or
+                                         self.current_size > self.max_size):
+            path, entry = self.entries.popitem(last=False)
+            self.current_size -= entry[2]
+            self.evictions += 1
@@ -50,6 +50,23 @@ class ComicStreamerConfig(ConfigObj):
             api_key=string(default="")
             use_api_key=boolean(default="False")
             cookie_secret=string(default="")
+            [cache]
+            page_cache_enabled=boolean(default="True")
+            page_cache_size_mb=integer(default=256)
+            readahead_window=integer(default=3)
+            readahead_cache_size_mb=integer(default=64)
+            open_zip_files=integer(default=32)
+            archive_cache_count=integer(default=50)
+            archive_cache_size_mb=integer(default=16)
+            rar_extract_cache_enabled=boolean(default="False")
+            rar_extract_cache_size_mb=integer(default=1024)
+            [workers]
+            image_workers=integer(default=2)
+            image_worker_max_jobs=integer(default=500)
+            scan_workers=integer(default=2)
+            scan_worker_max_jobs=integer(default=500)
+            scan_timeout=integer(default=120)
+            archive_threads=integer(default=4)
            """
     
 
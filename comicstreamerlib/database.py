@@ -15,7 +15,7 @@ from comicstreamerlib.folders import AppFolders
 from sqlalchemy.orm import scoped_session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, Float, String, DateTime, Table, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, DateTime, LargeBinary, Table, ForeignKey
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy import create_engine, func
 from sqlalchemy.ext.declarative import DeclarativeMeta
@@ -174,7 +174,7 @@ class Comic(Base):
     imprint = Column(String)
     weblink = Column(String)
     filesize = Column(Integer)
-    hash = Column(String)
+    hash = Column(String, index=True)  # utils.get_file_fingerprint()
     deleted_ts = Column(DateTime)
     lastread_ts = Column(DateTime)
     lastread_page = Column(Integer)
@@ -198,6 +198,12 @@ class Comic(Base):
                                 cascade="delete") #, backref='comics')
     genres_raw = relationship('Genre', secondary=comics_genres_table,
                                 cascade="delete") #, backref='comics')
+    thumbnail_raw = relationship('Thumbnail', uselist=False,
+                                cascade="all, delete-orphan")
+    pages_raw = relationship('Page', order_by='Page.index',
+                                cascade="all, delete-orphan")
+    backfill_failures_raw = relationship('BackfillFailure',
+                                cascade="all, delete-orphan")
 
     persons_raw = relationship("Person",
                 secondary="join(Credit, Person, Credit.person_id == Person.id)",
@@ -337,6 +343,54 @@ class Genre(Base):
                     Column('name', String, unique = True),
                     comparator_factory=MyComparator)
 
+class Thumbnail(Base):
+    __tablename__ = "thumbnails"
+    comic_id = Column(Integer, ForeignKey('comics.id'), primary_key=True)
+    image_type = Column(String)
+    data = Column(LargeBinary)
+
+class Page(Base):
+    # where each page is in the archive, in reading order, so serving a
+    # page doesn't need the archive listed and sorted again
+    __tablename__ = "pages"
+    comic_id = Column(Integer, ForeignKey('comics.id'), primary_key=True)
+    index = Column(Integer, primary_key=True)
+    name = Column(String)
+    offset = Column(Integer)            # of the data, if it's stored uncompressed in a zip
+    compress_size = Column(Integer)
+    file_size = Column(Integer)
+    compress_type = Column(Integer)
+    width = Column(Integer)
+    height = Column(Integer)
+
+class Folder(Base):
+    # each folder of the library as of the last full scan, so the next
+    # one can skip listing the ones that haven't changed since
+    __tablename__ = "folders"
+    path = Column(String, primary_key=True)
+    mod_ts = Column(DateTime)
+    file_count = Column(Integer)    # how many comics the DB had in it
+
+class RejectedFile(Base):
+    # files that weren't any good as comics, as of the given mtime and
+    # size, so scans can leave them be until they change
+    __tablename__ = "rejectedfiles"
+    path = Column(String, primary_key=True)
+    mod_ts = Column(DateTime)
+    filesize = Column(Integer)
+    reason = Column(String)
+    ts = Column(DateTime, default=datetime.utcnow)
+
+class BackfillFailure(Base):
+    # comics a backfill (thumbnails, pages, hashes) couldn't do anything
+    # with, so the next scan doesn't try them all over again.  a changed
+    # file comes back as a new comic, and gets another go
+    __tablename__ = "backfillfailures"
+    comic_id = Column(Integer, ForeignKey('comics.id'), primary_key=True)
+    kind = Column(String, primary_key=True)
+    reason = Column(String)
+    ts = Column(DateTime, default=datetime.utcnow)
+
 class DeletedComic(Base):
     __tablename__ = "deletedcomics"
     id = Column(Integer, primary_key=True)
@@ -415,6 +469,11 @@ class DataManager():
 
         # if we don't have a UUID for this DB, add it.
         Base.metadata.create_all(self.engine) 
+        # create_all doesn't add indexes to tables that are already there
+        self.engine.execute("CREATE INDEX IF NOT EXISTS ix_comics_hash ON comics (hash)")
+        # for finding the same issue in different files
+        self.engine.execute("CREATE INDEX IF NOT EXISTS ix_comics_issue_key "
+                            "ON comics (series COLLATE NOCASE, issue_num, page_count)")
 
         session = self.Session()
  
@@ -0,0 +1,123 @@
+# coding=utf-8
+
+"""
+ComicStreamer duplicate comic finder
+"""
+
+"""
+Copyright 2012-2014  Anthony Beville
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+	http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from sqlalchemy import func, and_
+
+from database import Comic
+
+def findDuplicates(session):
+    """
+    Groups of comics that look like the same thing.  Two comics match if
+    they have the same fingerprint (the same file, in two places), or the
+    same series, issue number and page count (say, a CBR and a CBZ of the
+    same issue).  Comics linked through either are in the same group.
+
+    Both keys are indexed, and kept up to date by the DB as the monitor
+    adds comics, so only the comics with a match are ever looked at.
+    Each group's wasted bytes are what keeping just its biggest file
+    would free.
+    """
+    comics = dict()     # id -> comic info
+    links = []          # (match type, ids with the same key)
+
+    dup_hashes = (session.query(Comic.hash)
+                    .filter(Comic.hash != None).filter(Comic.hash != "")
+                    .group_by(Comic.hash).having(func.count(Comic.id) > 1)
+                    .subquery())
+    query = (session.query(Comic.id, Comic.path, Comic.filesize, Comic.series, Comic.issue,
+                           Comic.page_count, Comic.hash)
+                .join(dup_hashes, Comic.hash == dup_hashes.c.hash)
+                .order_by(Comic.hash))
+    addLinks(query, lambda row: row.hash, "content", comics, links)
+
+    series = Comic.series.collate("NOCASE")
+    dup_issues = (session.query(series.label("series"), Comic.issue_num, Comic.page_count)
+                    .filter(Comic.series != None).filter(Comic.issue_num != None)
+                    .filter(Comic.page_count > 0)
+                    .group_by(series, Comic.issue_num, Comic.page_count)
+                    .having(func.count(Comic.id) > 1)
+                    .subquery())
+    query = (session.query(Comic.id, Comic.path, Comic.filesize, Comic.series, Comic.issue,
+                           Comic.page_count, Comic.hash, Comic.issue_num)
+                .join(dup_issues, and_(series == dup_issues.c.series,
+                                       Comic.issue_num == dup_issues.c.issue_num,
+                                       Comic.page_count == dup_issues.c.page_count))
+                .order_by(series, Comic.issue_num, Comic.page_count))
+    addLinks(query, lambda row: (row.series.lower(), row.issue_num, row.page_count), "issue", comics, links)
+
+    # merge the overlapping sets into groups
+    parent = dict((comic_id, comic_id) for comic_id in comics)
+    def find(comic_id):
+        while parent[comic_id] != comic_id:
+            parent[comic_id] = parent[parent[comic_id]]
+            comic_id = parent[comic_id]
+        return comic_id
+
+    for match, ids in links:
+        for comic_id in ids[1:]:
+            parent[find(comic_id)] = find(ids[0])
+
+    groups = dict()
+    for match, ids in links:
+        group = groups.setdefault(find(ids[0]), { 'match': set(), 'ids': set() })
+        group['match'].add(match)
+        group['ids'].update(ids)
+
+    result = []
+    total_wasted = 0
+    for group in groups.values():
+        members = sorted((comics[comic_id] for comic_id in group['ids']),
+                         key=lambda c: (-(c['filesize'] or 0), c['path']))
+        wasted = sum(c['filesize'] or 0 for c in members[1:])
+        total_wasted += wasted
+        result.append({ 'match': sorted(group['match']),
+                        'wasted_bytes': wasted,
+                        'comics': members,
+                      })
+    result.sort(key=lambda g: (-g['wasted_bytes'], g['comics'][0]['path']))
+
+    return { 'total_count': len(result),
+             'wasted_bytes': total_wasted,
+             'groups': result,
+           }
+
+def addLinks(query, key_func, match, comics, links):
+    # the rows come sorted by key, so each run of equal keys is one set
+    current_key = None
+    ids = []
+    for row in query:
+        comics[row.id] = { 'id': row.id,
+                           'path': row.path,
+                           'filesize': row.filesize,
+                           'series': row.series,
+                           'issue': row.issue,
+                           'page_count': row.page_count,
+                         }
+        key = key_func(row)
+        if key != current_key:
+            if len(ids) > 1:
+                links.append((match, ids))
+            current_key = key
+            ids = []
+        ids.append(row.id)
+    if len(ids) > 1:
+        links.append((match, ids))
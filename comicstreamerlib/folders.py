@@ -36,6 +36,7 @@ class AppFolders():
         make(AppFolders.logs())
         make(AppFolders.settings())
         make(AppFolders.appData())
+        make(AppFolders.cache())
 
     @staticmethod
     def runningAtRoolLevel():
@@ -106,6 +107,10 @@ class AppFolders():
             folder = os.path.join(AppFolders.userFolder())
         return folder
     
+    @staticmethod
+    def cache():
+        return os.path.join(AppFolders.appData(), "cache")
+
     @staticmethod
     def imagePath(filename):
         return os.path.join(AppFolders.appBase(), "static", "images", filename)
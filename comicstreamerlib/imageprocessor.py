@@ -0,0 +1,119 @@
+# coding=utf-8
+
+"""
+ComicStreamer image processing pool
+"""
+
+"""
+Copyright 2012-2014  Anthony Beville
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+	http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor, Future
+import concurrent.futures.process
+
+class PoolKilledError(Exception):
+    # the job's pool was killed by recycle() before the job could finish.
+    # it can be submitted again
+    pass
+
+class ImageProcessor():
+    """
+    Runs the PIL decode/resize work in a pool of worker processes, so a
+    big page doesn't stall the IOLoop for every other client.
+
+    After max_jobs submissions the whole pool is swapped for a fresh one.
+    The old pool finishes whatever it has queued, and then its workers
+    exit, taking any memory leaked by the image libraries (WebP!) with
+    them.
+
+    With workers set to 0, jobs are run inline, like in the old days.
+    """
+
+    def __init__(self, workers, max_jobs):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.executor = None
+        self.job_count = 0
+
+    @property
+    def inline(self):
+        return self.workers <= 0
+
+    def submit(self, fn, *args, **kwargs):
+        if self.inline:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        with self.lock:
+            if self.executor is not None and self.max_jobs > 0 and self.job_count >= self.max_jobs:
+                self.retire()
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers)
+                self.job_count = 0
+            self.job_count += 1
+            return self.executor.submit(fn, *args, **kwargs)
+
+    def recycle(self):
+        # for when a worker seems to be stuck: the pool is killed outright,
+        # since it would never drain.  its jobs that haven't finished are
+        # cancelled, or fail with PoolKilledError, and the next job gets a
+        # fresh pool
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is None:
+            return
+        logging.debug("ImageProcessor: killing worker pool")
+
+        # concurrent.futures has no way to do this, so it's done from the
+        # inside
+        with executor._shutdown_lock:
+            executor._shutdown_thread = True
+        for item in list(executor._pending_work_items.values()):
+            if not item.future.cancel() and not item.future.done():
+                item.future.set_exception(PoolKilledError())
+        # the pool's management thread would wait for the dead workers
+        # forever, and it's joined at exit, so it's forgotten about
+        thread = executor._queue_management_thread
+        if thread is not None:
+            concurrent.futures.process._threads_queues.pop(thread, None)
+        processes = executor._processes or []
+        if isinstance(processes, dict):
+            processes = processes.values()
+        for p in list(processes):
+            p.terminate()
+
+    # expects the lock to be held
+    def retire(self):
+        logging.debug("ImageProcessor: recycling worker pool")
+        # let the old pool drain in the background.  (a plain
+        # shutdown(wait=False) can trip over its own pipes)
+        t = threading.Thread(target=self.executor.shutdown)
+        t.daemon = True
+        t.start()
+        self.executor = None
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
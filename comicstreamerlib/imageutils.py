@@ -0,0 +1,221 @@
+# coding=utf-8
+
+"""
+Image helper functions shared by the server and the monitor
+"""
+
+"""
+Copyright 2012-2014  Anthony Beville
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+	http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import StringIO
+import imghdr
+from PIL import Image
+from PIL import WebPImagePlugin
+
+from libs.comictaggerlib.comicarchive import ComicArchive
+from comicstreamerlib.folders import AppFolders
+
+THUMBNAIL_HEIGHT = 200
+
+# contact sheets are a grid of fixed size cells, one per page
+CONTACT_SHEET_CELL = (100, 150)
+CONTACT_SHEET_COLUMNS = 10
+# pages are read this many at a time, which is a lot quicker for RARs
+CONTACT_SHEET_BATCH = 8
+
+# add webp test to imghdr in case it isn't there already
+def my_test_webp(h, f):
+    if h.startswith(b'RIFF') and h[8:12] == b'WEBP':
+        return 'webp'
+imghdr.tests.append(my_test_webp)
+
+def getImageType(image_data):
+    return imghdr.what(StringIO.StringIO(image_data))
+
+def getImageSize(image_data):
+    # (width, height) from just the start of an image, or (None, None) if
+    # that's not enough to tell.  webp is left alone, as ever
+    if image_data is None or getImageType(image_data) == "webp":
+        return None, None
+    try:
+        return Image.open(StringIO.StringIO(image_data)).size
+    except Exception:
+        return None, None
+
+def fitSize(size, max_width=None, max_height=None):
+    # scale (w,h) down to fit in the box, keeping the aspect ratio.
+    # either side of the box may be None, meaning unconstrained
+    w, h = size
+    scale = 1.0
+    if max_width is not None and max_width > 0:
+        scale = min(scale, float(max_width) / w)
+    if max_height is not None and max_height > 0:
+        scale = min(scale, float(max_height) / h)
+    if scale >= 1.0:
+        return size
+    return max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+
+def resizeImage(image_data, max_width=None, max_height=None, allow_webp=False):
+    # WebP leaks memory in the python library, so it's only decoded in
+    # pool workers that get recycled.  otherwise, substitute the default
+    imtype = getImageType(image_data)
+    if imtype == "webp" and not allow_webp:
+        with open(AppFolders.imagePath("default.jpg"), 'rb') as fd:
+            image_data = fd.read()
+
+    im = Image.open(StringIO.StringIO(image_data))
+    target = fitSize(im.size, max_width, max_height)
+    if target == im.size:
+        return image_data
+
+    im = scaleImage(im, target)
+    output = StringIO.StringIO()
+    im.save(output, format="JPEG")
+    return output.getvalue()
+
+def scaleImage(im, target):
+    # returns an RGB (or greyscale) copy of the opened image, at the target size
+    if im.format == "JPEG":
+        # have the decoder do the bulk of the reduction.  it can decode at
+        # 1/2, 1/4 or 1/8 scale for a fraction of the cost, and draft()
+        # picks the smallest rung of that ladder that's still at least as
+        # big as the target
+        im.draft("RGB", target)
+
+    if im.mode not in ("RGB", "L"):
+        im = im.convert("RGB")
+
+    if im.size == target:
+        return im
+
+    # the final step is a quality resample.  within 2x of the target,
+    # bicubic looks as good as lanczos, at a fraction of the cost
+    if im.size[0] < target[0] * 2 and im.size[1] < target[1] * 2:
+        resample = Image.BICUBIC
+    else:
+        resample = Image.ANTIALIAS
+    return im.resize(target, resample)
+
+def makeThumbnail(image_data, allow_webp=False):
+    # returns the thumbnail data, and its actual image type, which
+    # isn't always the same as the source image
+    thumbnail_data = resizeImage(image_data, max_height=THUMBNAIL_HEIGHT, allow_webp=allow_webp)
+    return thumbnail_data, getImageType(thumbnail_data)
+
+def makeContactSheet(path, allow_webp=False):
+    # every page of the comic, shrunk into its cell of one big sprite.
+    # returns the sprite data, and a manifest with the spot of each page.
+    # pages that couldn't be read get a stand-in, and are listed in the
+    # manifest as missing
+    cell_width, cell_height = CONTACT_SHEET_CELL
+    default_img_file = AppFolders.imagePath("default.jpg")
+    ca = ComicArchive(path, default_image_path=default_img_file)
+    page_count = ca.getNumberOfPages()
+    columns = max(1, min(CONTACT_SHEET_COLUMNS, page_count))
+    rows = max(1, (page_count + columns - 1) // columns)
+
+    sheet = Image.new("RGB", (columns * cell_width, rows * cell_height), "white")
+    pages = []
+    missing = []
+    for n in range(page_count):
+        if n % CONTACT_SHEET_BATCH == 0:
+            batch = ca.getPages(range(n, min(n + CONTACT_SHEET_BATCH, page_count)))
+        image_data = batch[n % CONTACT_SHEET_BATCH]
+        if image_data is None or image_data is ComicArchive.logo_data:
+            missing.append(n)
+        if image_data is None or (getImageType(image_data) == "webp" and not allow_webp):
+            with open(default_img_file, 'rb') as fd:
+                image_data = fd.read()
+        try:
+            im = Image.open(StringIO.StringIO(image_data))
+            im = scaleImage(im, fitSize(im.size, cell_width, cell_height))
+        except Exception:
+            if n not in missing:
+                missing.append(n)
+            im = Image.new("RGB", CONTACT_SHEET_CELL, "white")
+
+        # center the page in its cell
+        x = (n % columns) * cell_width + (cell_width - im.size[0]) // 2
+        y = (n // columns) * cell_height + (cell_height - im.size[1]) // 2
+        sheet.paste(im, (x, y))
+        pages.append({ 'page': n, 'x': x, 'y': y, 'width': im.size[0], 'height': im.size[1] })
+
+    output = StringIO.StringIO()
+    sheet.save(output, format="JPEG")
+    manifest = { 'cell_width': cell_width,
+                 'cell_height': cell_height,
+                 'columns': columns,
+                 'width': sheet.size[0],
+                 'height': sheet.size[1],
+                 'pages': pages,
+                 'missing': missing,
+               }
+    return output.getvalue(), manifest
+
+if __name__ == '__main__':
+    # benchmark the resize path against the old full decode+thumbnail
+    # one, over the pages of some real comics:
+    #     python -m comicstreamerlib.imageutils [-h height] comic...
+    import sys
+    import time
+    import getopt
+
+    def oldResizeImage(max, image_data):
+        im = Image.open(StringIO.StringIO(image_data))
+        w,h = im.size
+        if max < h:
+            im.thumbnail((w,max), Image.ANTIALIAS)
+            output = StringIO.StringIO()
+            im.save(output, format="JPEG")
+            return output.getvalue()
+        else:
+            return image_data
+
+    opts, args = getopt.getopt(sys.argv[1:], "h:")
+    heights = [int(a) for o, a in opts if o == "-h"] or [200, 800, 1200]
+    if len(args) == 0:
+        print >> sys.stderr, "usage:  {0} [-h height]... comic...".format(sys.argv[0])
+        sys.exit(-1)
+
+    pages = []
+    for path in args:
+        ca = ComicArchive(path, default_image_path=AppFolders.imagePath("default.jpg"))
+        for i in range(ca.getNumberOfPages()):
+            pages.append(ca.getPage(i))
+    print "{0} pages, sizes from {1} to {2}".format(len(pages),
+                min(Image.open(StringIO.StringIO(p)).size for p in pages),
+                max(Image.open(StringIO.StringIO(p)).size for p in pages))
+
+    for height in heights:
+        results = []
+        for name, func in [("old", lambda d: oldResizeImage(height, d)),
+                           ("new", lambda d: resizeImage(d, max_height=height))]:
+            times = []
+            for data in pages:
+                # best of a few runs, to smooth out the noise
+                best = None
+                for i in range(3):
+                    start = time.time()
+                    func(data)
+                    elapsed = time.time() - start
+                    if best is None or elapsed < best:
+                        best = elapsed
+                times.append(best)
+            times.sort()
+            results.append((name, sum(times), times[len(times)//2], times[-1]))
+        for name, total, median, worst in results:
+            print "height {0:5} {1}: total {2:7.3f}s  median {3:6.1f}ms  max {4:6.1f}ms".format(
+                    height, name, total, median * 1000, worst * 1000)
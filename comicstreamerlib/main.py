@@ -27,6 +27,7 @@ import logging
 import logging.handlers
 import platform
 import signal
+import multiprocessing
 
 import utils
 from config import ComicStreamerConfig
@@ -39,7 +40,7 @@ from bonjour import BonjourThread
  
 class Launcher():
     def signal_handler(self, signal, frame):
-        print "Caught Ctrl-C.  exiting."
+        print "Caught signal.  exiting."
         if self.apiServer:
             self.apiServer.shutdown()
         sys.exit()
@@ -90,6 +91,9 @@ class Launcher():
         self.apiServer.logConsoleHandler = sh
         
         signal.signal(signal.SIGINT, self.signal_handler)
+        # a plain kill needs the same cleanup, or the image worker
+        # processes are left behind holding the listening socket
+        signal.signal(signal.SIGTERM, self.signal_handler)
     
     
         bonjour = BonjourThread(self.apiServer.port)
@@ -118,5 +122,7 @@ class Launcher():
         logging.info("gui shoudld be done now")
 
 def main():
+    # needed for the image worker processes in a frozen windows app
+    multiprocessing.freeze_support()
     Launcher().go()
 
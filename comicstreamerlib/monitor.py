@@ -10,6 +10,8 @@ import time
 import threading
 import Queue
 import logging
+from collections import OrderedDict
+from concurrent.futures import TimeoutError, CancelledError
 from watchdog.observers import Observer
 from watchdog.events import LoggingEventHandler
 import watchdog
@@ -17,30 +19,210 @@ import watchdog
 from libs.comictaggerlib.comicarchive import *
 from libs.comictaggerlib.issuestring import *
 import utils
+import imageutils
+from imageprocessor import ImageProcessor, PoolKilledError
 
 from database import *
 
+# how much of the start of a page is read for the image size.  that's
+# usually in the first few KB, but a big EXIF block can push it further
+# out, so the read grows until PIL can tell, up to the max
+PAGE_HEAD_SIZE = 4 * 1024
+PAGE_HEAD_MAX = 256 * 1024
+# folders changed less than this many seconds before a scan get listed
+# again by the next one
+FOLDER_MTIME_SLACK = 2
+# file events are applied once there's been this many seconds of quiet
+EVENT_DELAY = 2
+# past this many changed paths, it's quicker to just do a full scan
+MAX_EVENT_PATHS = 1000
+# how many comics a backfill loads (and commits) at a time
+BACKFILL_BATCH = 100
+
 class  MonitorEventHandler(watchdog.events.FileSystemEventHandler):
     
     def __init__(self, monitor):
         self.monitor = monitor
-        self.ignore_directories = True
         
     def on_any_event(self,event):
-        if event.is_directory:
-            return
         self.monitor.handleSingleEvent(event)
 
 
+class RejectedComicError(Exception):
+    # a file that can't be added, for a reason that won't go away until
+    # the file changes
+    pass
+
+# the comic reading functions are at module level, so they can be run in
+# the scan worker processes
+
+def readComicMetadata(path, allow_webp=False):
+    if not utils.is_comic_filename(path):
+        return None
+    ca = ComicArchive(path,  default_image_path=AppFolders.imagePath("default.jpg"))
+    
+    if ca.seemsToBeAComicArchive():
+        logging.debug(u"Reading in {0}".format(path))
+
+        if ca.hasMetadata( MetaDataStyle.CIX ):
+            style = MetaDataStyle.CIX
+        elif ca.hasMetadata( MetaDataStyle.CBI ):
+            style = MetaDataStyle.CBI
+        else:
+            style = None
+            
+        if style is not None:
+            md = ca.readMetadata(style)
+        else:
+            # No metadata in comic.  make some guesses from the filename
+            md = ca.metadataFromFilename()
+            
+        md.path = ca.path 
+        md.page_count = ca.page_count
+        md.mod_ts = datetime.utcfromtimestamp(os.path.getmtime(ca.path))
+        md.filesize = os.path.getsize(md.path)
+        md.hash = utils.get_file_fingerprint(md.path) or ""
+        md.thumbnail, md.thumbnail_type = makeCoverThumbnail(ca, md, allow_webp)
+        md.page_index = makePageIndex(ca)
+        
+        return md
+    raise RejectedComicError(u"not a comic archive")
+            
+def makeCoverThumbnail(ca, md, allow_webp=False):
+    # use the page the metadata marks as the front cover, if any
+    cover_idx = md.getCoverPageIndexList()[0]
+    if cover_idx >= ca.getNumberOfPages():
+        cover_idx = 0
+    image_data = ca.getPage(cover_idx)
+    if image_data is None:
+        return None, None
+    try:
+        return imageutils.makeThumbnail(image_data, allow_webp)
+    except Exception as e:
+        logging.debug(u"Couldn't make thumbnail for {0}: {1}".format(ca.path, e))
+        return None, None
+    
+def makePageIndex(ca):
+    # where each page is, and how big, for the pages table.  the image
+    # size is only worked out for zips, where a peek at the start of
+    # the page is cheap
+    page_index = []
+    for i, (name, offset, compress_size, file_size, compress_type) in enumerate(ca.getPageInfoList()):
+        width = height = None
+        if ca.isZip():
+            width, height = readPageSize(ca, i)
+        page_index.append({ 'index': i,
+                            'name': name,
+                            'offset': offset,
+                            'compress_size': compress_size,
+                            'file_size': file_size,
+                            'compress_type': compress_type,
+                            'width': width,
+                            'height': height,
+                          })
+    return page_index
+
+def readPageSize(ca, index):
+    length = PAGE_HEAD_SIZE
+    while True:
+        head = ca.readPageHead(index, length)
+        width, height = imageutils.getImageSize(head)
+        if width is not None or head is None or len(head) < length or length >= PAGE_HEAD_MAX:
+            return width, height
+        length *= 4
+
+class FolderState():
+    """
+    What each library folder looked like at the end of the last full
+    scan.  A folder's mtime changes whenever a file in it is added,
+    removed or renamed, so if it's the same as then, and the DB still has
+    as many comics in it, there's no need to list it again.  Its
+    subfolders are still checked, since their changes don't show in the
+    parent's mtime.
+
+    (A comic rewritten in place doesn't touch the folder's mtime either.
+    The file watcher picks those up, or else the next full listing of the
+    folder does.)
+    """
+
+    def __init__(self, session, scan_start):
+        self.scan_start = scan_start
+        # folders are matched by normalized path, since the folder list
+        # may have them with trailing slashes and such
+        self.folders = dict()       # path -> (mod_ts, file_count)
+        self.subfolders = dict()    # path -> list of the subfolders, as walked
+        for path, mod_ts, file_count in session.query(Folder.path, Folder.mod_ts, Folder.file_count):
+            key = os.path.normpath(path)
+            self.folders[key] = (mod_ts, file_count)
+            self.subfolders.setdefault(os.path.dirname(key), []).append(path)
+        self.comic_counts = self.countComics(session)
+        self.visited = dict()       # path -> (path as walked, mtime)
+        self.pruned = set()
+        self.unfinished = set()     # folders with files to try again
+
+    def countComics(self, session):
+        counts = dict()
+        query = session.query(Comic.folder, func.count(Comic.id)).group_by(Comic.folder)
+        for folder, count in query:
+            if folder is not None:
+                key = os.path.normpath(folder)
+                counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def visit(self, path, mtime):
+        # the walker's callback.  returns the subfolders if the folder
+        # can be skipped
+        key = os.path.normpath(path)
+        self.visited[key] = (path, mtime)
+        old = self.folders.get(key)
+        if (old is not None and old[0] is not None and
+                old[0] == datetime.utcfromtimestamp(mtime) and
+                old[1] == self.comic_counts.get(key, 0)):
+            self.pruned.add(key)
+            return self.subfolders.get(key, [])
+        return None
+
+    def isPruned(self, folder):
+        return folder is not None and os.path.normpath(folder) in self.pruned
+
+    def retryLater(self, path):
+        # a file in the folder couldn't be read this time, but wasn't
+        # rejected either, so the folder mustn't be skipped next time
+        self.unfinished.add(os.path.normpath(os.path.dirname(path)))
+
+    def save(self, session):
+        # counted again, now that the scan's changes are in
+        counts = self.countComics(session)
+        session.query(Folder).delete()
+        for key, (path, mtime) in self.visited.items():
+            if mtime >= self.scan_start - FOLDER_MTIME_SLACK or key in self.unfinished:
+                # changed too close to the listing to be sure it caught
+                # everything, what with coarse mtimes on some filesystems,
+                # or has files to try again.  leave it to be listed again
+                # next time
+                mod_ts = None
+            else:
+                mod_ts = datetime.utcfromtimestamp(mtime)
+            session.add(Folder(path=path, mod_ts=mod_ts, file_count=counts.get(key, 0)))
+        session.commit()
+
 class Monitor():
         
-    def __init__(self, dm, paths):
+    def __init__(self, dm, paths, pagecache=None, scan_workers=0, scan_worker_max_jobs=500, scan_timeout=120):
         
         self.dm = dm
+        self.pagecache = pagecache
+        self.scan_workers = scan_workers
+        # a recycled process pool of its own, like the server's one for
+        # page images, so a big scan doesn't hold up the readers
+        self.processor = ImageProcessor(scan_workers, scan_worker_max_jobs)
+        # seconds to wait on any one file before giving up on it
+        self.scan_timeout = scan_timeout
         self.style = MetaDataStyle.CIX
         self.queue = Queue.Queue(0)
         self.paths = paths
-        self.eventList = []
+        self.eventList = OrderedDict()   # paths touched since the last processing
+        self.eventOverflow = False
         self.mutex = threading.Lock()
         self.eventProcessingTimer = None
         self.quit_when_done = False  # for debugging/testing
@@ -57,6 +239,7 @@ class Monitor():
     def stop(self):
         self.quit = True
         self.thread.join()
+        self.processor.shutdown()
 
     def mainLoop(self):
 
@@ -82,6 +265,15 @@ class Monitor():
 
             if msg == "events":
                 self.doEventProcessing(args)
+
+            if msg == "thumbnails":
+                self.doThumbnailBackfill()
+
+            if msg == "pages":
+                self.doPageIndexBackfill()
+
+            if msg == "hashes":
+                self.doHashBackfill()
             
             #time.sleep(1)
             if self.quit:
@@ -96,20 +288,31 @@ class Monitor():
         self.queue.put(("scan", None))
     
     def handleSingleEvent(self, event):
-        # events may happen in clumps.  start a timer
-        # to defer processing.  if the timer is already going,
-        # it will be canceled
-        
-        # in the future there can be more smarts about
-        # granular file events.  for now this will be
-        # good enough to just get a a trigger that *something*
-        # changed
+        # events may happen in clumps, like the stream of modifications
+        # while a file is copied in.  just note the paths, and start a
+        # timer to defer processing.  if the timer is already going, it
+        # will be canceled
         
         self.mutex.acquire()
         
+        if event.is_directory:
+            # a folder that comes or goes can take a whole tree of comics
+            # with it, without an event for each.  a folder's own
+            # modifications are just the files in it changing, though
+            if event.event_type != watchdog.events.EVENT_TYPE_MODIFIED:
+                self.eventOverflow = True
+        elif not self.eventOverflow:
+            self.eventList[event.src_path] = True
+            if event.event_type == watchdog.events.EVENT_TYPE_MOVED:
+                self.eventList[event.dest_path] = True
+            if len(self.eventList) > MAX_EVENT_PATHS:
+                self.eventOverflow = True
+        if self.eventOverflow:
+            self.eventList.clear()
+        
         if self.eventProcessingTimer is not None:
             self.eventProcessingTimer.cancel()
-        self.eventProcessingTimer = threading.Timer(30, self.handleEventProcessing)
+        self.eventProcessingTimer = threading.Timer(EVENT_DELAY, self.handleEventProcessing)
         self.eventProcessingTimer.start()
         
         self.mutex.release()
@@ -118,10 +321,15 @@ class Monitor():
     
     def handleEventProcessing(self):
         
-        # trigger a full rescan
         self.mutex.acquire()
         
-        self.scan()
+        if self.eventOverflow:
+            # too much going on to follow.  trigger a full rescan
+            self.scan()
+        elif len(self.eventList) > 0:
+            self.queue.put(("events", self.eventList.keys()))
+        self.eventList = OrderedDict()
+        self.eventOverflow = False
         
         # remove the timer
         if self.eventProcessingTimer is not None:
@@ -130,83 +338,149 @@ class Monitor():
         self.mutex.release()
 
 
-    def checkIfRemovedOrModified(self, comic, pathlist):
-        remove = False
-        
-        def inFolderlist(filepath, pathlist):
-            for p in pathlist:
-                if p in filepath:
-                    return True
+    def findChangedComics(self, disk_files, folder_state):
+        # one pass over the comic table, checked against what's on disk.
+        # returns (id, size, hash) of the comics whose files are gone, the
+        # ids of the comics to remove, and the files that need to be
+        # (re-)added
+        missing = []
+        removed = []
+        touched = []
+        unchanged = set()
+        query = self.session.query(Comic.id, Comic.path, Comic.folder, Comic.mod_ts,
+                                   Comic.filesize, Comic.hash)
+        for comic_id, path, folder, mod_ts, filesize, comic_hash in query:
+            stat = disk_files.get(path)
+            if stat is None and folder_state.isPruned(folder):
+                # the walk skipped its folder, as nothing there changed
+                pass
+            elif stat is None:
+                # the walk only covers the current folders, so this is
+                # either missing, or not in any of them anymore.  unless
+                # it turns up again under another name
+                missing.append((comic_id, filesize, comic_hash))
+            elif stat[0] != mod_ts and self.isSameContent(path, stat[1], filesize, comic_hash):
+                touched.append((comic_id, stat[0]))
+                unchanged.add(path)
+            elif stat[0] != mod_ts or (filesize is not None and stat[1] != filesize):
+                # if it's been modified, remove it, and it'll be re-added
+                logging.debug(u"Removed modifed {0}".format(path))
+                removed.append(comic_id)
+            else:
+                unchanged.add(path)
+
+        for comic_id, mod_ts in touched:
+            self.session.query(Comic).get(comic_id).mod_ts = mod_ts
+        self.touch_count += len(touched)
+
+        new_files = [path for path in disk_files if path not in unchanged]
+        return missing, removed, new_files
+
+    def isSameContent(self, path, size, filesize, comic_hash):
+        # for a file whose mtime changed.  if the fingerprint is the same,
+        # it was only touched, and there's no need to read it all again
+        if not comic_hash or size != filesize:
             return False
-        
-        if not (os.path.exists(comic.path)):
-            # file is missing, remove it from the comic table, add it to deleted table
-            logging.debug(u"Removing missing {0}".format(comic.path))
-            remove = True
-        elif not inFolderlist(comic.path, pathlist):
-            logging.debug(u"Removing unwanted {0}".format(comic.path))
-            remove = True
-        else:
-            # file exists.  check the mod date.
-            # if it's been modified, remove it, and it'll be re-added
-            #curr = datetime.datetime.fromtimestamp(os.path.getmtime(comic.path))
-            curr = datetime.utcfromtimestamp(os.path.getmtime(comic.path))
-            prev = comic.mod_ts
-            if curr != prev:
-                logging.debug(u"Removed modifed {0}".format(comic.path))
-                remove = True
-           
-        if remove:
-            self.removeComic(comic)
-            self.remove_count += 1
+        if utils.get_file_fingerprint(path) != comic_hash:
+            return False
+        logging.debug(u"Only the mtime changed on {0}".format(path))
+        return True
 
-    def getComicMetadata(self, path):
-        
-        #print time.time() - start_time, "seconds"
+    def findMovedComics(self, missing, new_files, disk_files):
+        # pairs up comics whose files have gone with new files of the same
+        # size and fingerprint, which are almost certainly them, moved or
+        # renamed.  comics from before there were fingerprints are matched
+        # by their page listing instead.  only pairs where neither side
+        # has another match count.  returns new path -> comic id
+        by_size = dict()
+        for comic_id, filesize, comic_hash in missing:
+            if filesize is not None:
+                by_size.setdefault(filesize, []).append((comic_id, comic_hash))
+        if len(by_size) == 0:
+            return dict()
 
-        ca = ComicArchive(path,  default_image_path=AppFolders.imagePath("default.jpg"))
-        
-        if ca.seemsToBeAComicArchive():
-            #print >>  sys.stdout, u"Adding {0}...     \r".format(count),
-            logging.debug(u"Reading in {0} {1}\r".format(self.read_count, path))
-            sys.stdout.flush()
-            self.read_count += 1
+        stored = dict()
+        path_matches = dict()
+        id_matches = dict()
+        for path in new_files:
+            candidates = by_size.get(disk_files[path][1])
+            if candidates is None:
+                continue
+            fingerprint = None
+            signature = None
+            for comic_id, comic_hash in candidates:
+                if comic_hash:
+                    if fingerprint is None:
+                        fingerprint = utils.get_file_fingerprint(path) or ""
+                    match = fingerprint == comic_hash
+                else:
+                    if signature is None:
+                        signature = self.readPageSignature(path) or ()
+                    if comic_id not in stored:
+                        stored[comic_id] = self.storedPageSignature(comic_id)
+                    match = len(signature) > 0 and stored[comic_id] == signature
+                if match:
+                    path_matches.setdefault(path, []).append(comic_id)
+                    id_matches.setdefault(comic_id, []).append(path)
+
+        moved = dict()
+        for path, ids in path_matches.items():
+            if len(ids) == 1 and len(id_matches[ids[0]]) == 1:
+                moved[path] = ids[0]
+        return moved
+
+    def readPageSignature(self, path):
+        # the page names and sizes, from just the archive's directory
+        ca = ComicArchive(path, default_image_path=AppFolders.imagePath("default.jpg"))
+        if not ca.seemsToBeAComicArchive():
+            return None
+        signature = []
+        for name, offset, compress_size, file_size, compress_type in ca.getPageInfoList():
+            if type(name) == str:
+                name = name.decode('utf-8', 'replace')
+            signature.append((name, compress_size, file_size))
+        return tuple(signature) or None
+
+    def storedPageSignature(self, comic_id):
+        # the same, from the pages table
+        query = self.session.query(Page.name, Page.compress_size, Page.file_size) \
+                    .filter(Page.comic_id == comic_id).order_by(Page.index)
+        return tuple(tuple(row) for row in query) or None
+
+    def moveComic(self, comic_id, path, mod_ts):
+        # same comic, new place.  it keeps its id, and its reading state
+        comic = self.session.query(Comic).get(comic_id)
+        logging.debug(u"Moved {0} to {1}".format(comic.path, path))
+        comic.path = path
+        comic.folder, comic.file = os.path.split(path)
+        comic.mod_ts = mod_ts
+        self.move_count += 1
+
+    def applyMoves(self, missing, new_files, disk_files):
+        # moves the comics that turn up among the new files, and removes
+        # the rest of the missing ones.  returns the files left to add
+        moved = self.findMovedComics(missing, new_files, disk_files)
+        for path, comic_id in moved.items():
+            self.moveComic(comic_id, path, disk_files[path][0])
+
+        moved_ids = set(moved.values())
+        for comic_id, filesize, comic_hash in missing:
+            if comic_id not in moved_ids:
+                comic = self.session.query(Comic).get(comic_id)
+                logging.debug(u"Removing missing or unwanted {0}".format(comic.path))
+                self.removeComic(comic)
+                self.remove_count += 1
+        return [path for path in new_files if path not in moved]
 
-            if ca.hasMetadata( MetaDataStyle.CIX ):
-                style = MetaDataStyle.CIX
-            elif ca.hasMetadata( MetaDataStyle.CBI ):
-                style = MetaDataStyle.CBI
-            else:
-                style = None
-                
-            if style is not None:
-                md = ca.readMetadata(style)
-            else:
-                # No metadata in comic.  make some guesses from the filename
-                md = ca.metadataFromFilename()
-                
-            md.path = ca.path 
-            md.page_count = ca.page_count
-            md.mod_ts = datetime.utcfromtimestamp(os.path.getmtime(ca.path))
-            md.filesize = os.path.getsize(md.path)
-            md.hash = ""
-            
-            #logging.debug("before hash")
-            #md5 = hashlib.md5()
-            #md5.update(open(md.path, 'r').read())
-            #md.hash = unicode(md5.hexdigest())
-            #logging.debug("after hash")
-            
-            return md
-        return None
-                
-                
-        
     def removeComic(self, comic):
         deleted = DeletedComic()
         deleted.comic_id = comic.id
         self.session.add(deleted)
         self.session.delete(comic)
+        # any rendered pages for this id are stale now.  if the file was
+        # modified it will be re-added with a new id
+        if self.pagecache is not None:
+            self.pagecache.invalidate(comic.id)
 
     def fetchObjByName(self, obj_dict, instance_name,):
         try:
@@ -233,6 +507,9 @@ class Monitor():
         comic.mod_ts = md.mod_ts
         comic.hash = md.hash
         comic.filesize = md.filesize
+        if md.thumbnail is not None:
+            comic.thumbnail_raw = Thumbnail(data=md.thumbnail, image_type=md.thumbnail_type)
+        comic.pages_raw = [Page(**p) for p in md.page_index]
         
         if not md.isEmpty:
             if md.series is not None:
@@ -476,53 +753,57 @@ class Monitor():
         logging.info(u"Monitor: Beginning file scan...")
         self.setStatusDetail(u"Monitor: Making a list of all files in the folders...")
 
-        filelist = utils.get_recursive_filelist( dirs )
-        self.setStatusDetail(u"Monitor: sorting recursive file list ({0} items)".format(len(filelist)))
-        filelist = sorted(filelist, key=os.path.getmtime)
+        # path -> (mtime, size) of every comic file.  the .nfo, .jpg,
+        # Thumbs.db etc. files are left out as they're found
+        folder_state = FolderState(self.session, time.time())
+        disk_files = dict()
+        for path, size, mtime in utils.walk_comic_files( dirs, folder_state.visit ):
+            disk_files[path] = (datetime.utcfromtimestamp(mtime), size)
+            if self.quit:
+                self.setStatusDetail(u"Monitor: halting scan!")
+                return
         
-        self.setStatusDetail(u"Monitor: done listing files.")
+        self.setStatusDetail(u"Monitor: done listing files.  {0} of {1} folders were unchanged.".format(
+                                len(folder_state.pruned), len(folder_state.visited)), logging.INFO)
         
         self.add_count = 0      
         self.remove_count = 0
-        
-        # get the entire comic table into memory
-        query = list(self.session.query(Comic))
+        self.move_count = 0
+        self.touch_count = 0
         
         # look for missing or changed files 
         self.setStatusDetail(u"Monitor: Removing missing or modified files from DB...")
-        #start_time = time.time()
-        for comic in query:
-            self.checkIfRemovedOrModified( comic, self.paths )
+        missing, removed, filelist = self.findChangedComics(disk_files, folder_state)
+        for comic_id in removed:
+            self.removeComic(self.session.query(Comic).get(comic_id))
+            self.remove_count += 1
             if self.quit:
                 self.setStatusDetail(u"Monitor: halting scan!")
                 return
+
+        # renamed and moved comics show up as both missing and new
+        self.setStatusDetail(u"Monitor: Looking for moved files...")
+        filelist = self.applyMoves(missing, filelist, disk_files)
+        filelist = self.skipRejectedFiles(filelist, disk_files, folder_state)
                 
-        #print time.time() - start_time, "seconds"
         self.setStatusDetail(u"Monitor: Done removing files.")
         
-        if self.remove_count > 0:
+        if self.remove_count > 0 or self.move_count > 0 or self.touch_count > 0:
             self.dm.engine.echo = True
             self.session.commit()
             self.dm.engine.echo = False
 
-        self.setStatusDetail(u"Monitor: found {0} files to inspect...".format(len(filelist)))
-        
-        # make a list of all path strings in comic table
-        db_pathlist = [i[0] for i in list(self.session.query(Comic.path))]
-        
-        self.setStatusDetail(u"Monitor: removing already scanned files from file list")
-        for f in db_pathlist:
-            if f in filelist:
-                filelist.remove(f)
-        db_pathlist = None
+        # oldest first, by the times the walk already got
+        self.setStatusDetail(u"Monitor: sorting new file list ({0} items)".format(len(filelist)))
+        filelist.sort(key=lambda path: disk_files[path][0])
 
         self.setStatusDetail(u"Monitor: {0} new files to scan...".format(len(filelist)), logging.INFO)
 
         md_list = []
         self.read_count = 0
-        for filename in filelist:
-            md = self.getComicMetadata( filename )
+        for md in self.readMetadataInParallel( filelist, disk_files, folder_state ):
             if md is not None:
+                self.read_count += 1
                 md_list.append(md)
             self.setStatusDetailOnly(u"Monitor: {0} files: {1} scanned, {2} added to library...".format(len(filelist), self.read_count,self.add_count))
             if self.quit:
@@ -537,6 +818,9 @@ class Monitor():
         
         if len(md_list) > 0:
             self.commitMetadataList(md_list)
+
+        # only a finished scan can vouch for the folders
+        folder_state.save(self.session)
         
         self.setStatusDetail(u"Monitor: finished scanning metadata in {0} of {1} files".format(self.read_count,len(filelist)), logging.INFO)
 
@@ -548,16 +832,331 @@ class Monitor():
         
         logging.info("Monitor: Added {0} comics".format(self.add_count))
         logging.info("Monitor: Removed {0} comics".format(self.remove_count))
+        logging.info("Monitor: Moved {0} comics".format(self.move_count))
         
-        if self.remove_count > 0 or self.add_count > 0:
+        if self.remove_count > 0 or self.add_count > 0 or self.move_count > 0:
             self.session.query(DatabaseInfo).first().last_updated = datetime.utcnow()
             self.session.commit()
             
+        # comics from earlier scans may not have a thumbnail or page index yet
+        self.queue.put(("thumbnails", None))
+        self.queue.put(("pages", None))
+        self.queue.put(("hashes", None))
+
         if self.quit_when_done:
             self.quit = True
 
+    def skipRejectedFiles(self, filelist, disk_files, folder_state=None):
+        # files that were no good last time, and haven't changed since,
+        # aren't worth opening again (a broken RAR can take a while to
+        # give up on).  returns the rest of the list.  the records of
+        # files that have changed are dropped, and so are those of files
+        # that are gone, when a full scan can tell
+        rejected = dict()
+        for path, mod_ts, filesize in self.session.query(RejectedFile.path, RejectedFile.mod_ts,
+                                                          RejectedFile.filesize):
+            rejected[path] = (mod_ts, filesize)
+        if len(rejected) == 0:
+            return filelist
+
+        remaining = []
+        for path in filelist:
+            if rejected.get(path) == disk_files[path]:
+                continue
+            remaining.append(path)
+
+        stale = [path for path in remaining if path in rejected]
+        if folder_state is not None:
+            stale += [path for path in rejected if path not in disk_files and
+                      not folder_state.isPruned(os.path.dirname(path))]
+        for path in stale:
+            self.session.query(RejectedFile).filter(RejectedFile.path == path).delete()
+
+        if len(remaining) < len(filelist):
+            logging.debug(u"Monitor: skipping {0} files that were rejected before".format(
+                            len(filelist) - len(remaining)))
+        return remaining
+
+    def rejectFile(self, path, disk_files, reason):
+        # remembered by the mtime and size from before it was read, so any
+        # change since then gets it another look
+        mod_ts, filesize = disk_files[path]
+        self.session.merge(RejectedFile(path=path, mod_ts=mod_ts, filesize=filesize,
+                                        reason=reason, ts=datetime.utcnow()))
+
+    def readMetadataInParallel(self, filelist, disk_files, folder_state=None):
+        # a walker thread hands the files to the worker processes, keeping
+        # a bounded number in flight, while this thread (the only one that
+        # touches the DB) takes the results as they come, in file order.
+        # the folders of files that should be tried again are marked in
+        # folder_state, if there is one
+        pending = Queue.Queue(max(4, self.scan_workers * 4))
+        stop = threading.Event()
+        allow_webp = not self.processor.inline
+        
+        def walk():
+            for path in filelist:
+                if stop.is_set():
+                    break
+                pending.put((path, self.processor.submit(readComicMetadata, path, allow_webp)))
+            pending.put(None)
+            
+        walker = threading.Thread(target=walk)
+        walker.daemon = True
+        walker.start()
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+                path, future = item
+                try:
+                    while True:
+                        try:
+                            md = future.result(timeout=self.scan_timeout)
+                            break
+                        except (CancelledError, PoolKilledError):
+                            # the pool was killed over some other file
+                            # before this one got done, so off it goes
+                            # to the new one
+                            future = self.processor.submit(readComicMetadata, path, allow_webp)
+                except TimeoutError:
+                    # not the file's fault, necessarily, so it's not
+                    # rejected, just tried again next scan.  the worker may
+                    # well be stuck, so the pool is killed, and the files
+                    # still waiting on it go to a fresh one
+                    logging.error(u"Monitor: timed out reading {0}".format(path))
+                    self.processor.recycle()
+                    if folder_state is not None:
+                        folder_state.retryLater(path)
+                    md = None
+                except RejectedComicError as e:
+                    logging.debug(u"Monitor: rejected {0}: {1}".format(path, e))
+                    self.rejectFile(path, disk_files, unicode(e))
+                    md = None
+                except (IOError, OSError) as e:
+                    # could well be gone by next time, like a file still
+                    # being copied in
+                    logging.error(u"Monitor: failed to read {0}: {1}".format(path, e))
+                    if folder_state is not None:
+                        folder_state.retryLater(path)
+                    md = None
+                except Exception as e:
+                    logging.error(u"Monitor: failed to read {0}: {1}".format(path, e))
+                    self.rejectFile(path, disk_files, unicode(e) or e.__class__.__name__)
+                    md = None
+                yield md
+        finally:
+            # on a quit, drop whatever's still queued up, and let the
+            # walker get to the end
+            stop.set()
+            while walker.is_alive():
+                try:
+                    item = pending.get(timeout=0.1)
+                    if item is not None:
+                        item[1].cancel()
+                except Queue.Empty:
+                    pass
+
+    def backfillQuery(self, query, kind):
+        # the comics still to do, leaving out the ones that failed before
+        return query.filter(~Comic.backfill_failures_raw.any(BackfillFailure.kind == kind))
+
+    def backfillBatches(self, query):
+        # the comics of the query, a batch at a time in id order, with a
+        # commit after each batch, so the whole list is never in memory
+        last_id = 0
+        while True:
+            batch = query.filter(Comic.id > last_id).order_by(Comic.id).limit(BACKFILL_BATCH).all()
+            if len(batch) == 0:
+                break
+            last_id = batch[-1].id
+            for comic in batch:
+                yield comic
+            self.session.commit()
+
+    def backfillFailed(self, comic, kind, reason):
+        logging.debug(u"Monitor: {0} backfill failed for {1}: {2}".format(kind, comic.path, reason))
+        comic.backfill_failures_raw.append(BackfillFailure(kind=kind, reason=reason))
+
+    def doThumbnailBackfill(self):
+        query = self.backfillQuery(self.session.query(Comic).outerjoin(Thumbnail)
+                                       .filter(Thumbnail.comic_id == None), "thumbnail")
+        total = query.count()
+        if total == 0:
+            return
+            
+        self.status = "SCANNING"
+        self.setStatusDetail(u"Monitor: making thumbnails for {0} comics...".format(total), logging.INFO)
+        
+        count = 0
+        for comic in self.backfillBatches(query):
+            try:
+                ca = ComicArchive(comic.path,  default_image_path=AppFolders.imagePath("default.jpg"))
+                if ca.seemsToBeAComicArchive():
+                    if ca.hasMetadata( MetaDataStyle.CIX ):
+                        md = ca.readMetadata( MetaDataStyle.CIX )
+                    else:
+                        md = GenericMetadata()
+                    data, imtype = makeCoverThumbnail(ca, md)
+                    if data is not None:
+                        comic.thumbnail_raw = Thumbnail(data=data, image_type=imtype)
+                        count += 1
+                    else:
+                        self.backfillFailed(comic, "thumbnail", u"no usable cover image")
+                else:
+                    self.backfillFailed(comic, "thumbnail", u"not a comic archive")
+            except Exception as e:
+                self.backfillFailed(comic, "thumbnail", unicode(e) or e.__class__.__name__)
+                
+            if self.quit:
+                self.setStatusDetail(u"Monitor: halting thumbnail backfill!")
+                break
+                
+        self.session.commit()
+        self.setStatusDetail(u"Monitor: made {0} thumbnails".format(count), logging.INFO)
+        self.status = "IDLE"
+        self.statusdetail = ""
+
+    def doPageIndexBackfill(self):
+        query = self.backfillQuery(self.session.query(Comic).outerjoin(Page)
+                                       .filter(Page.comic_id == None).filter(Comic.page_count > 0), "pages")
+        total = query.count()
+        if total == 0:
+            return
+            
+        self.status = "SCANNING"
+        self.setStatusDetail(u"Monitor: indexing pages of {0} comics...".format(total), logging.INFO)
+        
+        count = 0
+        for comic in self.backfillBatches(query):
+            try:
+                ca = ComicArchive(comic.path,  default_image_path=AppFolders.imagePath("default.jpg"))
+                if ca.seemsToBeAComicArchive():
+                    page_index = makePageIndex(ca)
+                    if len(page_index) > 0:
+                        comic.pages_raw = [Page(**p) for p in page_index]
+                        count += 1
+                    else:
+                        self.backfillFailed(comic, "pages", u"no pages found")
+                else:
+                    self.backfillFailed(comic, "pages", u"not a comic archive")
+            except Exception as e:
+                self.backfillFailed(comic, "pages", unicode(e) or e.__class__.__name__)
+                
+            if self.quit:
+                self.setStatusDetail(u"Monitor: halting page index backfill!")
+                break
+                
+        self.session.commit()
+        self.setStatusDetail(u"Monitor: indexed pages of {0} comics".format(count), logging.INFO)
+        self.status = "IDLE"
+        self.statusdetail = ""
+
+    def doHashBackfill(self):
+        query = self.backfillQuery(self.session.query(Comic)
+                                       .filter((Comic.hash == None) | (Comic.hash == "")), "hash")
+        total = query.count()
+        if total == 0:
+            return
+            
+        self.status = "SCANNING"
+        self.setStatusDetail(u"Monitor: fingerprinting {0} comics...".format(total), logging.INFO)
+        
+        count = 0
+        for comic in self.backfillBatches(query):
+            fingerprint = utils.get_file_fingerprint(comic.path)
+            if fingerprint is not None:
+                comic.hash = fingerprint
+                count += 1
+            else:
+                self.backfillFailed(comic, "hash", u"couldn't read the file")
+                
+            if self.quit:
+                self.setStatusDetail(u"Monitor: halting fingerprint backfill!")
+                break
+                
+        self.session.commit()
+        self.setStatusDetail(u"Monitor: fingerprinted {0} comics".format(count), logging.INFO)
+        self.status = "IDLE"
+        self.statusdetail = ""
+
     def doEventProcessing(self, eventList):
+        # the events only say which paths to look at.  whatever happened
+        # to each, the file as it is now decides what to do: add it,
+        # re-read it, remove it, or leave it be
         logging.debug(u"Monitor: event_list:{0}".format(eventList))
+        
+        self.status = "SCANNING"
+        self.add_count = 0
+        self.remove_count = 0
+        self.move_count = 0
+        self.touch_count = 0
+        filename_encoding = sys.getfilesystemencoding()
+        
+        missing = []
+        disk_files = dict()
+        for path in eventList:
+            if type(path) == str:
+                path = path.decode(filename_encoding, 'replace')
+            if not utils.is_comic_filename(path):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                st = None
+            if st is not None and not self.inLibrary(path):
+                # moved out to somewhere we're not watching
+                st = None
+            
+            comic = self.session.query(Comic).filter(Comic.path == path).first()
+            if comic is not None:
+                if st is None:
+                    missing.append((comic.id, comic.filesize, comic.hash))
+                    continue
+                mod_ts = datetime.utcfromtimestamp(st.st_mtime)
+                if comic.mod_ts == mod_ts and comic.filesize == st.st_size:
+                    continue
+                if self.isSameContent(path, st.st_size, comic.filesize, comic.hash):
+                    comic.mod_ts = mod_ts
+                    self.touch_count += 1
+                    continue
+                logging.debug(u"Removing changed {0}".format(path))
+                self.removeComic(comic)
+                self.remove_count += 1
+            if st is not None:
+                disk_files[path] = (datetime.utcfromtimestamp(st.st_mtime), st.st_size)
+        
+        # a move is a missing file at one end, and a new one at the other
+        filelist = self.applyMoves(missing, disk_files.keys(), disk_files)
+        filelist = self.skipRejectedFiles(filelist, disk_files)
+        
+        if self.remove_count > 0 or self.move_count > 0 or self.touch_count > 0:
+            self.session.commit()
+        
+        md_list = [md for md in self.readMetadataInParallel(filelist, disk_files) if md is not None]
+        if len(md_list) > 0:
+            self.commitMetadataList(md_list)
+        self.session.commit()
+        
+        logging.info(u"Monitor: {0} changed files: added {1} comics, removed {2}, moved {3}".format(
+                        len(eventList), self.add_count, self.remove_count, self.move_count))
+        
+        if self.remove_count > 0 or self.add_count > 0 or self.move_count > 0:
+            self.session.query(DatabaseInfo).first().last_updated = datetime.utcnow()
+            self.session.commit()
+        
+        self.status = "IDLE"
+        self.statusdetail = ""
+        self.scancomplete_ts = int(time.mktime(datetime.utcnow().timetuple()) * 1000)
+
+    def inLibrary(self, path):
+        path = os.path.normpath(path)
+        for folder in self.paths:
+            folder = os.path.normpath(folder)
+            if path.startswith(os.path.join(folder, u"")):
+                return True
+        return False
 
         
 if __name__ == '__main__':
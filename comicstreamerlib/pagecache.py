@@ -0,0 +1,183 @@
+# coding=utf-8
+
+"""
+ComicStreamer on-disk cache of rendered page images
+"""
+
+"""
+Copyright 2012-2014  Anthony Beville
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+	http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import logging
+from datetime import datetime
+from collections import OrderedDict
+
+class PageCache():
+    """
+    Keeps rendered (resized) page images on disk, so repeated requests
+    for the same page at the same size don't have to touch the archive
+    or PIL at all.
+
+    Each comic gets its own sub-folder, named by comic id, so all the
+    entries for a comic can be dropped in one go when the monitor
+    removes it.  The file name carries the rest of the key (page, size,
+    version, format).  Recency is kept in memory, and persisted via the
+    file modification time, so the LRU order survives a restart.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # relative path -> size, oldest first
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        self.load()
+
+    def load(self):
+        # rebuild the LRU index from whatever is already on disk
+        found = []
+        for root, dirs, files in os.walk(self.folder):
+            for f in files:
+                path = os.path.join(root, f)
+                if f.startswith(".tmp"):
+                    # left over from an interrupted write
+                    self.removeFile(path)
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, os.path.relpath(path, self.folder), st.st_size))
+
+        for mtime, relpath, size in sorted(found):
+            self.entries[relpath] = size
+            self.current_size += size
+
+        logging.debug(u"PageCache: {0} entries, {1} bytes".format(len(self.entries), self.current_size))
+        self.evict()
+
+    def makeKey(self, comic_id, version, page, size, fmt):
+        # version is whatever changes with the comic's content: its
+        # fingerprint, or the file's mod_ts
+        if isinstance(version, datetime):
+            version = version.strftime("%Y%m%d%H%M%S%f")
+        elif version is None:
+            version = "0"
+        return os.path.join(unicode(comic_id), u"{0}_{1}_{2}.{3}".format(page, size, version, fmt))
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            # move to the most-recent end
+            size = self.entries.pop(key)
+            self.entries[key] = size
+
+        path = os.path.join(self.folder, key)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            # it was evicted or removed underneath us
+            with self.lock:
+                self.forget(key)
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if self.max_size <= 0 or len(data) > self.max_size:
+            return
+
+        path = os.path.join(self.folder, key)
+        folder = os.path.dirname(path)
+        try:
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            # write to a temp file in the same folder, then rename it into
+            # place, so readers never see a partially written file
+            tmp_fd, tmp_name = tempfile.mkstemp(prefix=".tmp", dir=folder)
+            with os.fdopen(tmp_fd, 'wb') as fd:
+                fd.write(data)
+            with self.lock:
+                if os.path.exists(path):
+                    # windows won't rename over an existing file
+                    os.remove(path)
+                os.rename(tmp_name, path)
+                self.forget(key)
+                self.entries[key] = len(data)
+                self.current_size += len(data)
+                self.evict()
+        except (IOError, OSError) as e:
+            logging.warning(u"PageCache: couldn't write {0}: {1}".format(key, e))
+
+    def invalidate(self, comic_id):
+        prefix = unicode(comic_id) + os.sep
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix)]:
+                self.forget(key)
+            shutil.rmtree(os.path.join(self.folder, unicode(comic_id)), ignore_errors=True)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_size = 0
+            for item in os.listdir(self.folder):
+                shutil.rmtree(os.path.join(self.folder, item), ignore_errors=True)
+
+    def stats(self):
+        with self.lock:
+            return { 'entries': len(self.entries),
+                     'size': self.current_size,
+                     'max_size': self.max_size,
+                     'hits': self.hits,
+                     'misses': self.misses,
+                     'evictions': self.evictions,
+                   }
+
+    # the following must be called with the lock held
+
+    def forget(self, key):
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.current_size -= size
+
+    def evict(self):
+        while self.current_size > self.max_size and len(self.entries) > 0:
+            key, size = self.entries.popitem(last=False)
+            self.current_size -= size
+            self.evictions += 1
+            self.removeFile(os.path.join(self.folder, key))
+
+    def removeFile(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
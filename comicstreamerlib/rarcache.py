@@ -0,0 +1,168 @@
+# coding=utf-8
+
+"""
+ComicStreamer extracted CBR cache class
+"""
+
+"""
+Copyright 2012-2014  Anthony Beville
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+	http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import logging
+from collections import OrderedDict
+
+class RarExtractCache():
+    """
+    Reading one page out of a RAR costs a couple of unrar runs, and a
+    trip through the whole archive if it's solid.  So the first time a
+    page of a CBR is wanted, the whole thing is extracted into its own
+    folder, and the rest of the pages are just file reads.
+
+    Extracted comics are kept in LRU order, up to max_size bytes in
+    total.  An entry is thrown away as soon as the source file's mtime
+    or size changes.  The index only lives in memory, so whatever is on
+    disk from the last run is cleared out at startup.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()   # archive path -> (stamp, folder, size), oldest first
+        self.path_locks = dict()       # so an archive is only extracted once at a time
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.extractions = 0
+        self.evictions = 0
+
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder, ignore_errors=True)
+        os.makedirs(self.folder)
+
+    def read(self, path, archive_file, extract):
+        # returns the data of archive_file, or None if it can't be had from
+        # the cache, in which case the caller should read it the usual way.
+        # extract(folder) is called to unpack the archive when needed
+        folder = self.getFolder(path, extract)
+        if folder is None:
+            return None
+
+        folder = os.path.normpath(folder)
+        filename = os.path.normpath(os.path.join(folder, archive_file))
+        if not filename.startswith(folder + os.sep):
+            return None
+        try:
+            with open(filename, 'rb') as fd:
+                return fd.read()
+        except IOError:
+            # maybe evicted out from under us
+            return None
+
+    def getFolder(self, path, extract):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime, st.st_size)
+
+        with self.lock:
+            path_lock = self.path_locks.setdefault(path, threading.Lock())
+
+        with path_lock:
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry is not None:
+                    if entry[0] == stamp:
+                        del self.entries[path]
+                        self.entries[path] = entry
+                        self.hits += 1
+                        return entry[1]
+                    # the comic changed, so the extracted copy is stale
+                    self.forget(path)
+                self.misses += 1
+
+            folder = self.extract(path, extract)
+            if folder is None:
+                return None
+
+            size = self.folderSize(folder)
+            if size > self.max_size:
+                logging.debug(u"RarExtractCache: {0} is too big to keep".format(path))
+                self.removeFolder(folder)
+                return None
+
+            with self.lock:
+                self.entries[path] = (stamp, folder, size)
+                self.current_size += size
+                self.evict()
+            return folder
+
+    def extract(self, path, extract):
+        folder = tempfile.mkdtemp(dir=self.folder)
+        try:
+            extract(folder)
+        except Exception as e:
+            logging.debug(u"RarExtractCache: failed to extract {0}: {1}".format(path, e))
+            self.removeFolder(folder)
+            return None
+        self.extractions += 1
+        return folder
+
+    def clear(self):
+        with self.lock:
+            for path in self.entries.keys():
+                self.forget(path)
+
+    def stats(self):
+        with self.lock:
+            return { 'entries': len(self.entries),
+                     'size': self.current_size,
+                     'max_size': self.max_size,
+                     'hits': self.hits,
+                     'misses': self.misses,
+                     'extractions': self.extractions,
+                     'evictions': self.evictions,
+                   }
+
+    # these expect the lock to be held
+    def forget(self, path):
+        stamp, folder, size = self.entries.pop(path)
+        self.current_size -= size
+        self.removeFolder(folder)
+
+    def evict(self):
+        # never the newest entry, which is about to be read from
+        while self.current_size > self.max_size and len(self.entries) > 1:
+            path = next(iter(self.entries))
+            self.forget(path)
+            self.evictions += 1
+
+    def folderSize(self, folder):
+        size = 0
+        for root, dirs, files in os.walk(folder):
+            for f in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, f))
+                except OSError:
+                    pass
+        return size
+
+    def removeFolder(self, folder):
+        shutil.rmtree(folder, ignore_errors=True)
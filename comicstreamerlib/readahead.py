@@ -0,0 +1,189 @@
+# coding=utf-8
+
+"""
+ComicStreamer page read-ahead thread class
+"""
+
+"""
+Copyright 2012-2014  Anthony Beville
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+	http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+import logging
+import Queue
+from collections import OrderedDict
+
+from libs.comictaggerlib.comicarchive import ComicArchive
+import imageutils
+
+class ReadAhead(threading.Thread):
+    """
+    While a reader is on page N, extract (and resize) the next few pages
+    into a memory cache, so the page turns don't each pay for the archive
+    and PIL.
+
+    Each client has at most one read-ahead plan.  A new page request from
+    the same client replaces it, so a jump to another page or comic
+    cancels whatever was left of the old plan.  The thread only works
+    while no foreground page requests are in flight.
+
+    Archives come from open_archive(path, comic_id, mod_ts), which is the
+    server's getComicArchive, so the read-ahead shares its archive cache
+    (and through that, the open zip handles and extracted RARs).
+    """
+
+    def __init__(self, window, max_size, imageprocessor, open_archive):
+        super(ReadAhead, self).__init__()
+
+        self.queue = Queue.Queue(0)
+        self.quit = False
+        self.daemon = True
+        self.window = window
+        self.max_size = max_size
+        self.imageprocessor = imageprocessor
+        self.open_archive = open_archive
+
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.foreground_count = 0
+        self.plans = dict()         # client -> current plan generation
+        self.generation = 0
+        self.cache = OrderedDict()  # key -> image data, oldest first
+        self.current_size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.cancelled = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0 and self.max_size > 0
+
+    def makeKey(self, comic_id, version, pagenum, size_token):
+        return (int(comic_id), version, int(pagenum), size_token)
+
+    def get(self, key):
+        with self.lock:
+            data = self.cache.pop(key, None)
+            if data is None:
+                self.misses += 1
+                return None
+            self.cache[key] = data
+            self.hits += 1
+            return data
+
+    def foregroundBegin(self):
+        with self.lock:
+            self.foreground_count += 1
+
+    def foregroundEnd(self):
+        with self.lock:
+            self.foreground_count -= 1
+            if self.foreground_count == 0:
+                self.idle.notify_all()
+
+    def schedule(self, client, comic_id, path, mod_ts, version, pagenum, page_count, max_width, max_height, size_token):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.generation += 1
+            self.plans[client] = self.generation
+            plan = (client, self.generation)
+
+        last = min(pagenum + self.window, page_count - 1)
+        for n in range(pagenum + 1, last + 1):
+            key = self.makeKey(comic_id, version, n, size_token)
+            self.queue.put((plan, key, path, mod_ts, n, max_width, max_height))
+
+    def stop(self):
+        self.quit = True
+        with self.lock:
+            self.idle.notify_all()
+        self.join()
+
+    def stats(self):
+        with self.lock:
+            return { 'window': self.window,
+                     'entries': len(self.cache),
+                     'size': self.current_size,
+                     'max_size': self.max_size,
+                     'hits': self.hits,
+                     'misses': self.misses,
+                     'prefetched': self.prefetched,
+                     'cancelled': self.cancelled,
+                     'evictions': self.evictions,
+                   }
+
+    def run(self):
+        logging.debug("ReadAhead: started main loop.")
+        while True:
+            try:
+                job = self.queue.get(block=True, timeout=1)
+            except Queue.Empty:
+                job = None
+
+            if self.quit:
+                break
+
+            if job is not None:
+                try:
+                    self.prefetch(*job)
+                except Exception as e:
+                    logging.debug(u"ReadAhead: failed to prefetch: {0}".format(e))
+
+        logging.debug("ReadAhead: stopped main loop.")
+
+    def isCurrent(self, plan):
+        client, generation = plan
+        return self.plans.get(client) == generation
+
+    def prefetch(self, plan, key, path, mod_ts, pagenum, max_width, max_height):
+        with self.lock:
+            # stay out of the way of the foreground requests
+            while self.foreground_count > 0 and not self.quit:
+                self.idle.wait(1)
+            if not self.isCurrent(plan):
+                self.cancelled += 1
+                return
+            if key in self.cache:
+                return
+
+        ca = self.open_archive(path, key[0], mod_ts)
+        resize = max_width is not None or max_height is not None
+        if not resize and ca.getPageLocation(pagenum) is not None:
+            # the server sends these straight from the file anyway
+            return
+        image_data = ca.getPage(pagenum)
+        if image_data is None or image_data is ComicArchive.logo_data:
+            return
+
+        if resize:
+            processor = self.imageprocessor
+            image_data = processor.submit(imageutils.resizeImage, image_data,
+                                          max_width, max_height, not processor.inline).result()
+
+        with self.lock:
+            if not self.isCurrent(plan):
+                self.cancelled += 1
+                return
+            self.cache[key] = image_data
+            self.current_size += len(image_data)
+            self.prefetched += 1
+            while self.current_size > self.max_size and len(self.cache) > 0:
+                k, data = self.cache.popitem(last=False)
+                self.current_size -= len(data)
+                self.evictions += 1
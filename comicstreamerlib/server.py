@@ -24,6 +24,8 @@ from datetime import date
 import tornado.escape
 import tornado.ioloop
 import tornado.web
+import tornado.gen
+import tornado.iostream
 import urllib
 from urllib2 import quote
 
@@ -35,20 +37,22 @@ from  sqlalchemy.sql.expression import func, select
 import json
 import pprint
 import mimetypes
-from PIL import Image
-from PIL import WebPImagePlugin
 import StringIO
 import gzip
+import zipfile
 import dateutil.parser
+import email.utils
+import calendar
 import logging
 import logging.handlers
-import imghdr
 import random
 import signal
 import sys
 import socket
 import webbrowser
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from libs.comictaggerlib.comicarchive import *
 
@@ -61,13 +65,13 @@ from comicstreamerlib.folders import AppFolders
 from options import Options
 from bonjour import BonjourThread
 from bookmarker import Bookmarker
-
-# add webp test to imghdr in case it isn't there already
-def my_test_webp(h, f):
-    if h.startswith(b'RIFF') and h[8:12] == b'WEBP':
-        return 'webp'
-imghdr.tests.append(my_test_webp)
-
+from pagecache import PageCache
+from imageprocessor import ImageProcessor
+from readahead import ReadAhead
+from rarcache import RarExtractCache
+from archivecache import ComicArchiveCache
+from duplicates import findDuplicates
+import imageutils
 
 # to allow a blank username
 def fix_username(username):
@@ -84,6 +88,10 @@ class BaseHandler(tornado.web.RequestHandler):
         return custom_get_current_user(self)
     
 class GenericAPIHandler(BaseHandler):
+    # files go out a chunk at a time, waiting for each one to drain, so a
+    # big download never holds more than this in memory
+    CHUNK_SIZE = 256 * 1024
+
     def validateAPIKey(self):
         if self.application.config['security']['use_api_key']:
             api_key = self.get_argument(u"api_key", default="")
@@ -93,6 +101,67 @@ class GenericAPIHandler(BaseHandler):
                 raise tornado.web.HTTPError(400)
                 return False
     
+    def contentVersion(self, obj):
+        # what identifies the comic's content, for the caches.  the
+        # fingerprint outlives a touch of the file, mod_ts doesn't
+        if obj.hash:
+            return obj.hash
+        return obj.mod_ts.strftime("%Y%m%d%H%M%S%f")
+
+    def makeETag(self, obj, *parts):
+        # a comic's content only changes when its file does, so the id,
+        # content version and rendering parameters fully identify the
+        # response
+        tag = u"{0}-{1}".format(obj.id, self.contentVersion(obj))
+        for p in parts:
+            tag += u"-{0}".format(p)
+        return u'"{0}"'.format(tag)
+
+    def setCacheHeaders(self, etag, last_modified):
+        # only for responses made from the real content.  a stand-in image
+        # for a page that couldn't be read mustn't be kept for a year
+        self.set_header("Etag", etag)
+        self.set_header("Last-Modified", last_modified)
+        self.set_header("Cache-Control", "max-age=31536000")
+
+    def checkNotModified(self, etag, last_modified):
+        # return True if the client's copy is still current, in which case
+        # a 304 is already set up and the caller should just return,
+        # without touching the archive.  the client only has the validators
+        # if it got the real content, so it's fine to hand them back here
+        if_none_match = self.request.headers.get("If-None-Match")
+        if_modified_since = self.request.headers.get("If-Modified-Since")
+        not_modified = False
+        if if_none_match is not None:
+            tags = [t.strip() for t in if_none_match.split(",")]
+            not_modified = etag in tags or "*" in tags
+        elif if_modified_since is not None:
+            ts = email.utils.parsedate_tz(if_modified_since)
+            if ts is not None:
+                client_time = email.utils.mktime_tz(ts)
+                not_modified = calendar.timegm(last_modified.utctimetuple()) <= client_time
+                
+        if not_modified:
+            self.setCacheHeaders(etag, last_modified)
+            self.set_status(304)
+        return not_modified
+
+    @tornado.gen.coroutine
+    def sendFileData(self, fd, start, length):
+        # write length bytes of the open file, from start on
+        fd.seek(start)
+        remaining = length
+        try:
+            while remaining > 0:
+                data = fd.read(min(self.CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                self.write(data)
+                yield self.flush()
+        except tornado.iostream.StreamClosedError:
+            logging.debug(u"Client went away during download of {0}".format(self.request.path))
+
 
 class JSONResultAPIHandler(GenericAPIHandler):
     def setContentType(self):
@@ -347,43 +416,124 @@ class CommandAPIHandler(GenericAPIHandler):
 class ImageAPIHandler(GenericAPIHandler):
     def setContentType(self, image_data):
         
-        imtype = imghdr.what(StringIO.StringIO(image_data))
+        imtype = imageutils.getImageType(image_data)
         self.add_header("Content-type","image/{0}".format(imtype))
     
-    def getImageData(self, comic_id, pagenum):
-        #TODO handle errors in this func!
+    def getComic(self, comic_id):
         session = self.application.dm.Session()
-        obj = session.query(Comic).filter(Comic.id == int(comic_id)).first()
+        return session.query(Comic).filter(Comic.id == int(comic_id)).first()
+
+    def getImageData(self, comic_id, pagenum, obj=None):
+        # returns (image data, found).  when the page can't be had, the
+        # data is a stand-in image, and found is False so that nobody
+        # caches it in place of the real thing
+        #TODO handle errors in this func!
+        if obj is None and comic_id is not None:
+            obj = self.getComic(comic_id)
         image_data = None
         default_img_file = AppFolders.imagePath("default.jpg")
 
         if obj is not None:
             if int(pagenum) < obj.page_count:
-                ca = self.application.getComicArchive(obj.path)
+                ca = self.application.getComicArchive(obj.path, obj.id, obj.mod_ts)
                 image_data = ca.getPage(int(pagenum))
+                # the archive hands back its logo when the page is
+                # unreadable.  that's only recognizable right here, before
+                # it's been resized or copied
+                if image_data is ComicArchive.logo_data:
+                    return image_data, False
     
         if image_data is None:
             with open(default_img_file, 'rb') as fd:
                 image_data = fd.read()
+            return image_data, False
             
-        return image_data
+        return image_data, True
     
-    def resizeImage(self, max, image_data):
-        # disable WebP for now, due a memory leak in python library
-        imtype = imghdr.what(StringIO.StringIO(image_data))
-        if imtype == "webp":
-            with open(AppFolders.imagePath("default.jpg"), 'rb') as fd:
-                image_data = fd.read()
+    def readImageData(self, obj, pagenum):
+        # getImageData, off the IOLoop thread: a RAR page can mean unpacking
+        # the whole archive, or waiting for the read-ahead thread to finish
+        # doing so.  returns a future
+        return self.application.archive_executor.submit(self.getImageData, None, pagenum, obj)
+
+    def getSizeArgs(self):
+        # max_width and max_height can be given alone, or together as a
+        # box to fit the image in.  bad values are ignored
+        size = []
+        for arg in [u"max_width", u"max_height"]:
+            value = self.get_argument(arg, default=None)
+            try:
+                size.append(int(value) if value is not None else None)
+            except ValueError as e:
+                logging.error(e)
+                size.append(None)
+        return tuple(size)
+
+    def getSizeToken(self, max_width, max_height):
+        token = ""
+        if max_width is not None:
+            token += "w{0}".format(max_width)
+        if max_height is not None:
+            token += "h{0}".format(max_height)
+        return token
+
+    def resizeImage(self, image_data, max_width, max_height):
+        # returns a future; yield it from a coroutine
+        processor = self.application.imageprocessor
+        return processor.submit(imageutils.resizeImage, image_data, max_width, max_height, not processor.inline)
+
+    def makeThumbnail(self, image_data):
+        processor = self.application.imageprocessor
+        return processor.submit(imageutils.makeThumbnail, image_data, not processor.inline)
+
+    @tornado.gen.coroutine
+    def getPage(self, obj, pagenum, max_width, max_height):
+        # page image, resized as asked, from the read-ahead or resized
+        # page caches if possible.  returns a future of (image data, found),
+        # like getImageData
+        readahead = self.application.readahead
+        readahead.foregroundBegin()
+        try:
+            result = yield self.getPageUncached(obj, pagenum, max_width, max_height)
+        finally:
+            readahead.foregroundEnd()
+        raise tornado.gen.Return(result)
+
+    @tornado.gen.coroutine
+    def getPageUncached(self, obj, pagenum, max_width, max_height):
+        pagecache = self.application.pagecache
+        readahead = self.application.readahead
+        size_token = self.getSizeToken(max_width, max_height)
+        resize = max_width is not None or max_height is not None
+        valid_page = obj is not None and pagenum < obj.page_count
         
-        im = Image.open(StringIO.StringIO(image_data))
-        w,h = im.size
-        if max < h:
-            im.thumbnail((w,max), Image.ANTIALIAS)
-            output = StringIO.StringIO()
-            im.save(output, format="JPEG")
-            return output.getvalue()
-        else:
-            return image_data
+        if valid_page:
+            image_data = readahead.get(readahead.makeKey(obj.id, self.contentVersion(obj), pagenum, size_token))
+            if image_data is not None:
+                raise tornado.gen.Return((image_data, True))
+        
+        # only resized pages are cached on disk; the originals are cheap
+        # to pull straight out of the archive
+        cache_key = None
+        if resize and pagecache is not None and valid_page:
+            cache_key = pagecache.makeKey(obj.id, self.contentVersion(obj), pagenum, size_token, "jpg")
+            image_data = pagecache.get(cache_key)
+            if image_data is not None:
+                raise tornado.gen.Return((image_data, True))
+        
+        image_data, found = yield self.readImageData(obj, pagenum)
+        
+        if resize:
+            try:
+                image_data = yield self.resizeImage(image_data, max_width, max_height)
+            except Exception as e:
+                logging.error(e)
+                cache_key = None
+        
+        if cache_key is not None and found:
+            pagecache.put(cache_key, image_data)
+        
+        raise tornado.gen.Return((image_data, found))
             
 class VersionAPIHandler(JSONResultAPIHandler):
     def get(self):
@@ -421,6 +571,28 @@ class ScanStatusAPIHandler(JSONResultAPIHandler):
         self.setContentType()
         self.write(response)
             
+class CacheStatsAPIHandler(JSONResultAPIHandler):
+    def get(self):
+        self.validateAPIKey()
+        pagecache = self.application.pagecache
+        rarcache = self.application.rarcache
+        response = { 'archives': self.application.archivecache.stats(),
+                     'readahead': self.application.readahead.stats(),
+                     'pagecache': pagecache.stats() if pagecache is not None else None,
+                     'zipfiles': zip_file_pool.stats(),
+                     'rarextract': rarcache.stats() if rarcache is not None else None,
+                    }
+        self.setContentType()
+        self.write(response)
+
+class DuplicatesAPIHandler(JSONResultAPIHandler):
+    def get(self):
+        self.validateAPIKey()
+        session = self.application.dm.Session()
+        response = findDuplicates(session)
+        self.setContentType()
+        self.write(response)
+            
 class ComicListAPIHandler(ZippableAPIHandler):
     def get(self):
         self.validateAPIKey()
@@ -478,6 +650,17 @@ class DeletedAPIHandler(ZippableAPIHandler):
                 
         self.writeResults(json_data)    
 
+class RejectedAPIHandler(ZippableAPIHandler):
+    def get(self):
+        self.validateAPIKey()
+    
+        # files the scanner found but couldn't add, and why
+        session = self.application.dm.Session()
+        resultset = session.query(RejectedFile).order_by(RejectedFile.path)
+        json_data = resultSetToJson(resultset, "rejectedfiles")
+                
+        self.writeResults(json_data)    
+
 class ComicListBrowserHandler(BaseHandler):
     @tornado.web.authenticated
     def get(self):
@@ -545,34 +728,235 @@ class ComicBookmarkAPIHandler(JSONResultAPIHandler):
         self.write(response)
         
 class ComicPageAPIHandler(ImageAPIHandler):
+    @tornado.gen.coroutine
     def get(self, comic_id, pagenum):
         self.validateAPIKey()
         
-        image_data = self.getImageData(comic_id, pagenum)
+        obj = self.getComic(comic_id)
+        pagenum = int(pagenum)
+        max_width, max_height = self.getSizeArgs()
+        size_token = self.getSizeToken(max_width, max_height)
+        valid_page = obj is not None and pagenum < obj.page_count
         
-        max_height = self.get_argument(u"max_height", default=None)
-        if max_height is not None:
-            try:
-                max_h = int(max_height)
-                image_data = self.resizeImage(max_h, image_data)
-            except Exception as e:
-                logging.error(e)
-                pass
+        if valid_page:
+            etag = self.makeETag(obj, pagenum, size_token)
+            if self.checkNotModified(etag, obj.mod_ts):
+                return
+        
+        if valid_page and max_width is None and max_height is None:
+            sent = yield self.sendStoredPage(obj, pagenum, etag)
+        else:
+            sent = False
+        if not sent:
+            image_data, found = yield self.getPage(obj, pagenum, max_width, max_height)
+            if found:
+                self.setCacheHeaders(etag, obj.mod_ts)
+        
+        # get the next few pages ready while the client is reading this one
+        if valid_page:
+            self.application.readahead.schedule(self.getReader(), obj.id, obj.path, obj.mod_ts, self.contentVersion(obj),
+                                                pagenum, obj.page_count, max_width, max_height, size_token)
         
-        self.setContentType(image_data)
-        self.write(image_data)
+        if not sent:
+            self.setContentType(image_data)
+            self.write(image_data)
+
+    def getReader(self):
+        # who's reading, for the read-ahead plans.  the address alone would
+        # lump together everyone behind the same NAT, so browsers get a
+        # cookie.  clients that don't keep it are told apart by user agent
+        reader = self.get_cookie("cs_reader")
+        if reader is None:
+            self.set_cookie("cs_reader", uuid.uuid4().hex, expires_days=365)
+            reader = (self.request.remote_ip, self.request.headers.get("User-Agent"))
+        return reader
+
+    @tornado.gen.coroutine
+    def sendStoredPage(self, obj, pagenum, etag):
+        # a page that's stored uncompressed in a zip is sent straight from
+        # the file, without reading it all in.  returns False if the page
+        # isn't stored that way
+        location = self.getIndexedPageLocation(obj, pagenum)
+        if location is False:
+            # not indexed yet (or the file changed since), ask the archive
+            ca = self.application.getComicArchive(obj.path, obj.id, obj.mod_ts)
+            location = ca.getPageLocation(pagenum)
+        if location is None:
+            raise tornado.gen.Return(False)
+        
+        offset, size = location
+        with open(obj.path, 'rb') as fd:
+            # the image type only takes a peek at the start
+            fd.seek(offset)
+            self.setContentType(fd.read(min(32, size)))
+            self.setCacheHeaders(etag, obj.mod_ts)
+            self.set_header("Content-Length", size)
+            yield self.sendFileData(fd, offset, size)
+        raise tornado.gen.Return(True)
+
+    def getIndexedPageLocation(self, obj, pagenum):
+        # (offset, size) of the page from the page index, None if it's not
+        # stored as is, or False if the index can't tell
+        session = self.application.dm.Session()
+        page = session.query(Page).filter(Page.comic_id == obj.id).filter(Page.index == pagenum).first()
+        if page is None:
+            return False
+        if page.offset is None:
+            return None
+        try:
+            if datetime.utcfromtimestamp(os.path.getmtime(obj.path)) != obj.mod_ts:
+                return False
+        except OSError:
+            return False
+        return page.offset, page.file_size
+
+class ZipStream():
+    # just enough of a write-only file for ZipFile to build an archive
+    # into, while the finished bits get handed off to the client
+    def __init__(self):
+        self.position = 0
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = "".join(self.chunks)
+        self.chunks = []
+        return data
+
+class ComicPagesAPIHandler(ImageAPIHandler):
+    @tornado.gen.coroutine
+    def get(self, comic_id):
+        self.validateAPIKey()
+
+        obj = self.getComic(comic_id)
+        if obj is None or obj.page_count == 0:
+            raise tornado.web.HTTPError(404)
+
+        try:
+            first = int(self.get_argument(u"from", default=0))
+            last = int(self.get_argument(u"to", default=obj.page_count - 1))
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        last = min(last, obj.page_count - 1)
+        if first < 0 or first > last:
+            raise tornado.web.HTTPError(400)
+
+        max_width, max_height = self.getSizeArgs()
+        # no validators here: the headers go out before the pages are
+        # read, so there's no telling yet whether they all can be
+
+        filename = u"{0} [{1}-{2}].zip".format(os.path.splitext(os.path.basename(obj.path))[0], first, last)
+        self.set_header("Content-Type", "application/zip")
+        self.add_header("Content-Disposition", u"attachment; filename=\"{0}\"".format(filename).encode("utf-8"))
+
+        # the pages are mostly jpegs already, so they are stored, not
+        # compressed.  each page goes out as soon as it's ready, so only
+        # one is ever held in memory (plus the little zip directory)
+        stream = ZipStream()
+        zf = zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED)
+        date_time = obj.mod_ts.timetuple()[:6]
+        try:
+            for pagenum in range(first, last + 1):
+                image_data, found = yield self.getPage(obj, pagenum, max_width, max_height)
+                ext = imageutils.getImageType(image_data) or "jpg"
+                if ext == "jpeg":
+                    ext = "jpg"
+                info = zipfile.ZipInfo(u"{0:03}.{1}".format(pagenum, ext), date_time)
+                info.external_attr = 0644 << 16
+                zf.writestr(info, image_data)
+                self.write(stream.drain())
+                yield self.flush()
+            zf.close()
+            self.write(stream.drain())
+        except tornado.iostream.StreamClosedError:
+            logging.debug(u"Client went away during page download of comic {0}".format(obj.id))
+
+class ContactSheetAPIHandler(ImageAPIHandler):
+    @tornado.gen.coroutine
+    def get(self, comic_id, manifest):
+        self.validateAPIKey()
+
+        obj = self.getComic(comic_id)
+        if obj is None:
+            raise tornado.web.HTTPError(404)
+
+        etag = self.makeETag(obj, "contactsheet", "manifest" if manifest else "image")
+        if self.checkNotModified(etag, obj.mod_ts):
+            return
+
+        image_data, manifest_data, complete = yield self.getContactSheet(obj)
+        if complete:
+            self.setCacheHeaders(etag, obj.mod_ts)
+        if manifest:
+            self.set_header("Content-Type", "application/json; charset=UTF-8")
+            self.write(manifest_data)
+        else:
+            self.setContentType(image_data)
+            self.write(image_data)
+
+    @tornado.gen.coroutine
+    def getContactSheet(self, obj):
+        # the sheet and its manifest are made (and cached) together, since
+        # a client that wants one will want the other right after.  a sheet
+        # with stand-ins for unreadable pages isn't cached.  returns a
+        # future of (sheet, manifest, complete)
+        pagecache = self.application.pagecache
+        if pagecache is not None:
+            image_key = pagecache.makeKey(obj.id, self.contentVersion(obj), "contactsheet", "", "jpg")
+            manifest_key = pagecache.makeKey(obj.id, self.contentVersion(obj), "contactsheet", "", "json")
+            image_data = pagecache.get(image_key)
+            manifest_data = pagecache.get(manifest_key)
+            if image_data is not None and manifest_data is not None:
+                raise tornado.gen.Return((image_data, manifest_data, True))
+
+        processor = self.application.imageprocessor
+        image_data, manifest = yield processor.submit(imageutils.makeContactSheet, obj.path, not processor.inline)
+        manifest_data = json.dumps(manifest)
+        complete = len(manifest['missing']) == 0
+
+        if pagecache is not None and complete:
+            pagecache.put(image_key, image_data)
+            pagecache.put(manifest_key, manifest_data)
+        raise tornado.gen.Return((image_data, manifest_data, complete))
 
 class ThumbnailAPIHandler(ImageAPIHandler):
+    @tornado.gen.coroutine
     def get(self, comic_id):
         self.validateAPIKey()
-        image_data = self.getImageData(comic_id, 0)
-        #now resize it
-        thumbail_data = self.resizeImage(200, image_data)
+        obj = self.getComic(comic_id)
+        
+        if obj is not None:
+            etag = self.makeETag(obj, "thumbnail")
+            if self.checkNotModified(etag, obj.mod_ts):
+                return
+        
+        # the monitor stores a cover thumbnail when it scans the comic
+        if obj is not None and obj.thumbnail_raw is not None:
+            self.setCacheHeaders(etag, obj.mod_ts)
+            self.add_header("Content-type","image/{0}".format(obj.thumbnail_raw.image_type))
+            self.write(str(obj.thumbnail_raw.data))
+            return
+        
+        # not backfilled yet, so make one on the fly
+        image_data, found = yield self.readImageData(obj, 0)
+        thumbnail_data, imtype = yield self.makeThumbnail(image_data)
+        if found:
+            self.setCacheHeaders(etag, obj.mod_ts)
     
-        self.setContentType(image_data)
-        self.write(thumbail_data)
+        self.add_header("Content-type","image/{0}".format(imtype))
+        self.write(thumbnail_data)
 
 class FileAPIHandler(GenericAPIHandler):
+    @tornado.gen.coroutine
     def get(self, comic_id):
         self.validateAPIKey()
 
@@ -580,18 +964,90 @@ class FileAPIHandler(GenericAPIHandler):
         session = self.application.dm.Session()
         obj = session.query(Comic).filter(Comic.id == int(comic_id)).first()
         if obj is not None:
-            ca = self.application.getComicArchive(obj.path)
+            # the fingerprint only covers part of the file, which is fine
+            # for telling pages apart, but a byte range has to come from
+            # exactly the same file, so this one goes by the file itself
+            try:
+                st = os.stat(obj.path)
+            except OSError:
+                raise tornado.web.HTTPError(404)
+            last_modified = datetime.utcfromtimestamp(int(st.st_mtime))
+            etag = u'"{0}-file-{1}-{2}"'.format(obj.id, st.st_size, repr(st.st_mtime))
+            if self.checkNotModified(etag, last_modified):
+                return
+                
+            ca = self.application.getComicArchive(obj.path, obj.id, obj.mod_ts)
             if ca.isZip():
-                self.add_header("Content-type","application/zip, application/octet-stream")
+                self.set_header("Content-Type","application/zip, application/octet-stream")
             else:
-                self.add_header("Content-type","application/x-rar-compressed, application/octet-stream")
+                self.set_header("Content-Type","application/x-rar-compressed, application/octet-stream")
                 
             self.add_header("Content-Disposition", "attachment; filename=" + os.path.basename(obj.path))    
+            self.set_header("Accept-Ranges", "bytes")
 
             with open(obj.path, 'rb') as fd:
-                file_data = fd.read()
-    
-            self.write(file_data)
+                fd.seek(0, os.SEEK_END)
+                size = fd.tell()
+                self.setCacheHeaders(etag, last_modified)
+
+                byte_range = self.getByteRange(size, etag, last_modified)
+                if byte_range is None:
+                    self.set_status(416)
+                    self.set_header("Content-Range", "bytes */{0}".format(size))
+                    return
+                start, end, partial = byte_range
+                if partial:
+                    self.set_status(206)
+                    self.set_header("Content-Range", "bytes {0}-{1}/{2}".format(start, end - 1, size))
+                self.set_header("Content-Length", end - start)
+
+                yield self.sendFileData(fd, start, end - start)
+
+    def getByteRange(self, size, etag, last_modified):
+        # work out which part of the file to send, as (start, end, partial),
+        # with end exclusive.  returns None if the range can't be satisfied.
+        # anything we don't understand (including multiple ranges) gets the
+        # whole file, which is always a legal answer
+        whole = (0, size, False)
+        range_header = self.request.headers.get("Range")
+        if range_header is None:
+            return whole
+
+        # a range only applies to the version of the file the client has
+        if_range = self.request.headers.get("If-Range")
+        if if_range is not None:
+            if_range = if_range.strip()
+            if if_range.startswith('"') or if_range.startswith('W/'):
+                if if_range != etag:
+                    return whole
+            else:
+                ts = email.utils.parsedate_tz(if_range)
+                if ts is None or email.utils.mktime_tz(ts) != calendar.timegm(last_modified.utctimetuple()):
+                    return whole
+
+        unit, _, spec = range_header.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return whole
+        first, dash, last = spec.strip().partition("-")
+        try:
+            if first == "":
+                # suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    return None
+                start, end = max(0, size - length), size
+            else:
+                start = int(first)
+                end = int(last) + 1 if last != "" else size
+        except ValueError:
+            return whole
+        if dash != "-" or start < 0:
+            return whole
+        if start >= size:
+            return None
+        if end <= start:
+            return whole
+        return start, min(end, size), True
 
 class FolderAPIHandler(JSONResultAPIHandler):
     def get(self, args):            
@@ -1138,7 +1594,33 @@ class APIServer(tornado.web.Application):
         self.opts = opts
         
         self.port = self.config['general']['port']
-        self.comicArchiveList = []
+        self.archivecache = ComicArchiveCache(self.config['cache']['archive_cache_count'],
+                                              self.config['cache']['archive_cache_size_mb'] * 1024 * 1024)
+        
+        self.pagecache = None
+        if self.config['cache']['page_cache_enabled']:
+            self.pagecache = PageCache(os.path.join(AppFolders.cache(), "pages"),
+                                       self.config['cache']['page_cache_size_mb'] * 1024 * 1024)
+        
+        self.imageprocessor = ImageProcessor(self.config['workers']['image_workers'],
+                                             self.config['workers']['image_worker_max_jobs'])
+        zip_file_pool.max_handles = self.config['cache']['open_zip_files']
+        # the pool only closes idle handles when it's used, so a quiet
+        # server would keep its last few files open indefinitely
+        self.zip_reaper = tornado.ioloop.PeriodicCallback(zip_file_pool.reapIdle,
+                                                          zip_file_pool.idle_timeout * 1000)
+        
+        self.rarcache = None
+        if self.config['cache']['rar_extract_cache_enabled']:
+            self.rarcache = RarExtractCache(os.path.join(AppFolders.cache(), "rar"),
+                                            self.config['cache']['rar_extract_cache_size_mb'] * 1024 * 1024)
+        
+        # for reading pages out of the archives
+        self.archive_executor = ThreadPoolExecutor(self.config['workers']['archive_threads'])
+        
+        self.readahead = ReadAhead(self.config['cache']['readahead_window'],
+                                   self.config['cache']['readahead_cache_size_mb'] * 1024 * 1024,
+                                   self.imageprocessor, self.getComicArchive)
         
         #if len(self.config['general']['folder_list']) == 0:
         #    logging.error("No folders on either command-line or config file.  Quitting.")
@@ -1199,16 +1681,21 @@ class APIServer(tornado.web.Application):
             (r"/dbinfo", DBInfoAPIHandler),
             (r"/version", VersionAPIHandler),
             (r"/deleted", DeletedAPIHandler),
+            (r"/rejected", RejectedAPIHandler),
             (r"/comic/([0-9]+)", ComicAPIHandler),
             (r"/comiclist", ComicListAPIHandler),
             (r"/comic/([0-9]+)/page/([0-9]+|clear)/bookmark", ComicBookmarkAPIHandler ),
             (r"/comic/([0-9]+)/page/([0-9]+)", ComicPageAPIHandler ),
+            (r"/comic/([0-9]+)/pages", ComicPagesAPIHandler),
+            (r"/comic/([0-9]+)/contactsheet(/manifest)?", ContactSheetAPIHandler),
             (r"/comic/([0-9]+)/thumbnail", ThumbnailAPIHandler),
             (r"/comic/([0-9]+)/file", FileAPIHandler),
             (r"/entities(/.*)*", EntityAPIHandler),
             (r"/folders(/.*)*", FolderAPIHandler),
             (r"/command", CommandAPIHandler),
             (r"/scanstatus", ScanStatusAPIHandler),
+            (r"/cachestats", CacheStatsAPIHandler),
+            (r"/duplicates", DuplicatesAPIHandler),
             #(r'/favicon.ico', tornado.web.StaticFileHandler, {'path': os.path.join(AppFolders.appBase(), "static","images")}),
             (r'/.*', UnknownHandler),
             
@@ -1231,12 +1718,17 @@ class APIServer(tornado.web.Application):
             for l in self.config['general']['folder_list']:
                 logging.debug(u"   {0}".format(repr(l)))
 
-            self.monitor = Monitor(self.dm, self.config['general']['folder_list'])
+            self.monitor = Monitor(self.dm, self.config['general']['folder_list'], self.pagecache,
+                                   self.config['workers']['scan_workers'],
+                                   self.config['workers']['scan_worker_max_jobs'],
+                                   self.config['workers']['scan_timeout'])
             self.monitor.start()
             self.monitor.scan()
             
         self.bookmarker = Bookmarker(self.dm)
         self.bookmarker.start()
+        self.readahead.start()
+        self.zip_reaper.start()
 
         if opts.launch_browser and self.config['general']['launch_browser']:
             if ((platform.system() == "Linux" and os.environ.has_key('DISPLAY')) or
@@ -1276,6 +1768,11 @@ class APIServer(tornado.web.Application):
         logging.info('Initiating shutdown...')
         self.monitor.stop()
         self.bookmarker.stop()
+        self.readahead.stop()
+        self.imageprocessor.shutdown()
+        self.archive_executor.shutdown(wait=False)
+        self.zip_reaper.stop()
+        zip_file_pool.clear()
      
         logging.info('Will shutdown ComicStreamer in maximum %s seconds ...', MAX_WAIT_SECONDS_BEFORE_SHUTDOWN)
         io_loop = tornado.ioloop.IOLoop.instance()
@@ -1312,17 +1809,27 @@ class APIServer(tornado.web.Application):
         t = threading.Thread(target=self.run)
         t.start()
         
-    def getComicArchive(self, path):
-        # should also look at modified time of file
-        for ca in self.comicArchiveList:
-            if ca.path == path:
-                # remove from list and put at end
-                self.comicArchiveList.remove(ca)
-                self.comicArchiveList.append(ca)
-                return ca
-        else:
-            ca = ComicArchive(path, default_image_path=AppFolders.imagePath("default.jpg"))
-            self.comicArchiveList.append(ca)
-            if len(self.comicArchiveList) > 10:
-                self.comicArchiveList.pop(0)
-            return ca
+    def getComicArchive(self, path, comic_id=None, mod_ts=None):
+        return self.archivecache.get(path, lambda: self.openComicArchive(path, comic_id, mod_ts))
+        
+    def openComicArchive(self, path, comic_id=None, mod_ts=None):
+        ca = ComicArchive(path, default_image_path=AppFolders.imagePath("default.jpg"),
+                          rar_extract_cache=self.rarcache)
+        # the page list from the index saves listing and sorting the
+        # archive, but only while the file is still the one that was indexed
+        try:
+            current = mod_ts is not None and datetime.utcfromtimestamp(os.path.getmtime(path)) == mod_ts
+        except OSError:
+            current = False
+        if comic_id is not None and current:
+            # this runs on the archive and read-ahead threads too, so it
+            # gets a session of its own, closed right away, instead of
+            # leaving a connection behind in the thread's scoped session
+            session = self.dm.Session.session_factory()
+            try:
+                page_list = [p.name for p in session.query(Page.name).filter(Page.comic_id == comic_id).order_by(Page.index)]
+            finally:
+                session.close()
+            if len(page_list) > 0:
+                ca.setPageNameList(page_list)
+        return ca
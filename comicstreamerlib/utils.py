@@ -21,15 +21,22 @@ limitations under the License.
 """
 import sys
 import os
+import stat
 import re
 import platform
 import locale
 import codecs
 import calendar
 import hashlib
+import struct
 import time
 
 from datetime import datetime, timedelta
+
+try:
+	from scandir import scandir
+except ImportError:
+	scandir = None
 	
 class UtilsVars:
 	already_fixed_encoding = False
@@ -51,6 +58,12 @@ def fix_output_encoding( ):
 		sys.stderr = codecs.getwriter(preferred_encoding)(sys.stderr)
 		UtilsVars.already_fixed_encoding = True
 
+# the only kinds of files worth opening up to look for a comic
+COMIC_EXTENSIONS = [ ".cbz", ".cbr", ".zip", ".rar" ]
+
+def is_comic_filename( path ):
+	return os.path.splitext( path )[1].lower() in COMIC_EXTENSIONS
+
 def get_recursive_filelist( pathlist ):
 	"""
 	Get a recursive list of of all files under all path items in the list
@@ -81,6 +94,125 @@ def get_recursive_filelist( pathlist ):
 	
 	return filelist
 	
+def walk_comic_files( pathlist, visit_folder=None ):
+	"""
+	Walk all the path items in the list, yielding (path, size, mtime) for
+	each comic file under them, one stat apiece.
+
+	If given, visit_folder(folder, mtime) is called for each folder before
+	it's listed.  It can return a list of the folder's subfolders, in which
+	case the folder itself isn't listed, and only those subfolders are
+	walked.
+	"""
+	filename_encoding = sys.getfilesystemencoding()
+
+	def to_unicode(p):
+		if type(p) == str:
+			#make sure string is unicode
+			return p.decode(filename_encoding, 'replace')
+		elif type(p) != unicode:
+			#it's probably a QString
+			return unicode(p)
+		return p
+
+	for p in pathlist:
+		p = to_unicode(p)
+		if not os.path.isdir( p ):
+			if is_comic_filename(p):
+				try:
+					st = os.stat(p)
+				except OSError:
+					continue
+				yield p, st.st_size, st.st_mtime
+			continue
+
+		folders = [p]
+		while folders:
+			folder = folders.pop()
+			if visit_folder is not None:
+				try:
+					mtime = os.stat(folder).st_mtime
+				except OSError:
+					continue
+				subfolders = visit_folder(to_unicode(folder), mtime)
+				if subfolders is not None:
+					folders.extend(subfolders)
+					continue
+			try:
+				dirs, files = list_comic_folder(folder)
+			except OSError:
+				continue
+			folders.extend(dirs)
+			for path, st in files:
+				yield to_unicode(path), st.st_size, st.st_mtime
+
+def list_comic_folder( folder ):
+	"""
+	Get the subfolders of a folder, and (path, stat) for the comic files in it
+	"""
+	dirs = []
+	files = []
+	if scandir is not None:
+		# scandir hands back the entry types with the names, so only
+		# the comics themselves need a stat
+		for entry in scandir(folder):
+			try:
+				if entry.is_dir():
+					# like os.walk, don't follow links to folders
+					if not entry.is_symlink():
+						dirs.append(entry.path)
+				elif is_comic_filename(entry.name):
+					files.append((entry.path, entry.stat()))
+			except OSError:
+				pass
+	else:
+		for name in os.listdir(folder):
+			path = os.path.join(folder, name)
+			if is_comic_filename(name):
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				if stat.S_ISREG(st.st_mode):
+					files.append((path, st))
+					continue
+			if os.path.isdir(path) and not os.path.islink(path):
+				dirs.append(path)
+	return dirs, files
+
+# how much of a file the fingerprint reads, besides any zip directory
+FINGERPRINT_BLOCK = 4096
+FINGERPRINT_MAX_DIRECTORY = 1024 * 1024
+
+def get_file_fingerprint( path ):
+	"""
+	A quick stand-in for a hash of the whole file.  It covers the size, a
+	block each from the start, middle and end, and the zip central
+	directory if there is one, which has the CRC of every member in it.
+	Returns None if the file can't be read
+	"""
+	try:
+		with open(path, 'rb') as f:
+			f.seek(0, os.SEEK_END)
+			size = f.tell()
+			digest = hashlib.sha1(str(size))
+			for offset in [0, (size - FINGERPRINT_BLOCK) // 2, size - FINGERPRINT_BLOCK]:
+				f.seek(max(0, offset))
+				block = f.read(FINGERPRINT_BLOCK)
+				digest.update(block)
+
+			# the end of central directory record, when the archive comment
+			# is short enough for it to be in the last block
+			pos = block.rfind(b"PK\x05\x06")
+			if pos >= 0 and len(block) - pos >= 22:
+				cd_size, cd_offset = struct.unpack("<LL", block[pos+12:pos+20])
+				if cd_offset + cd_size <= size:
+					f.seek(cd_offset)
+					digest.update(f.read(min(cd_size, FINGERPRINT_MAX_DIRECTORY)))
+	except (IOError, OSError):
+		return None
+	return digest.hexdigest()
+
 def touch(fname, times=None):
     with open(fname, 'a'):
         os.utime(fname, times)
@@ -26,6 +26,9 @@ import tempfile
 import subprocess
 import platform
 import locale
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from natsort import natsorted
 
 if platform.system() == "Windows":
@@ -56,38 +59,220 @@ class MetaDataStyle:
 	COMET = 2
 	name = [ 'ComicBookLover', 'ComicRack', 'CoMet' ]
 
+class ZipFilePool:
+	"""
+	A bounded pool of open ZipFile handles, shared by all the ZipArchivers,
+	so that reading a page only costs a seek and a decompress, instead of
+	re-parsing the central directory of the whole archive every time.
+
+	Handles are keyed by path, modification time and size, so a changed
+	file never gets a stale handle.  A handle is checked out by one
+	reader at a time (ZipFile isn't safe to share between threads), and
+	goes back to the idle list afterwards.  Idle handles are closed after
+	idle_timeout seconds, or when max_handles would be exceeded.  Nothing
+	here runs on its own, so a long-running owner should call reapIdle()
+	now and then, or handles can stay open (and the files locked, on
+	Windows) for as long as nobody reads a page.
+	"""
+
+	def __init__( self, max_handles=32, idle_timeout=60 ):
+		self.max_handles = max_handles
+		self.idle_timeout = idle_timeout
+		self.reset()
+
+	def reset( self ):
+		self.pid = os.getpid()
+		self.lock = threading.Lock()
+		self.idle = OrderedDict()	# (key, id(zf)) -> (zf, last used), oldest first
+		self.open_count = 0
+		self.generation = dict()	# path -> count of invalidations
+		self.hits = 0
+		self.misses = 0
+
+	@contextmanager
+	def open( self, path ):
+		key, zf = self.checkout( path )
+		try:
+			yield zf
+		except:
+			self.release( key, zf, discard=True )
+			raise
+		else:
+			self.release( key, zf )
+
+	def checkout( self, path ):
+		if self.pid != os.getpid():
+			# a forked worker process must not use the parent's handles,
+			# which share their file positions with the parent's, or its
+			# lock, which might have been held at the time of the fork
+			self.reset()
+		statinfo = os.stat( path )
+		with self.lock:
+			key = ( path, statinfo.st_mtime, statinfo.st_size, self.generation.get( path, 0 ) )
+			self.closeIdle( time.time() - self.idle_timeout )
+			for idle_key, ( zf, last_used ) in self.idle.iteritems():
+				if idle_key[0] == key:
+					del self.idle[ idle_key ]
+					self.hits += 1
+					return key, zf
+			self.misses += 1
+			# make room, if we can.  if every handle is busy, go over the
+			# limit for now, the extra one gets closed on release
+			if self.open_count >= self.max_handles and len( self.idle ) > 0:
+				self.closeOldest()
+			self.open_count += 1
+
+		try:
+			zf = zipfile.ZipFile( path, 'r' )
+		except:
+			with self.lock:
+				self.open_count -= 1
+			raise
+		return key, zf
+
+	def release( self, key, zf, discard=False ):
+		with self.lock:
+			if ( discard or self.open_count > self.max_handles or
+			     key[3] != self.generation.get( key[0], 0 ) ):
+				self.open_count -= 1
+				zf.close()
+			else:
+				self.idle[ ( key, id( zf ) ) ] = ( zf, time.time() )
+			self.closeIdle( time.time() - self.idle_timeout )
+
+	def invalidate( self, path ):
+		# the file is being (or has been) written to, so forget all the
+		# handles to it.  busy ones are closed when they come back
+		with self.lock:
+			self.generation[ path ] = self.generation.get( path, 0 ) + 1
+			for idle_key in [ k for k in self.idle.keys() if k[0][0] == path ]:
+				zf, last_used = self.idle.pop( idle_key )
+				self.open_count -= 1
+				zf.close()
+
+	def reapIdle( self ):
+		# close the handles that have been idle for too long
+		if self.pid != os.getpid():
+			return
+		with self.lock:
+			self.closeIdle( time.time() - self.idle_timeout )
+
+	def clear( self ):
+		with self.lock:
+			while len( self.idle ) > 0:
+				self.closeOldest()
+
+	def stats( self ):
+		with self.lock:
+			return { 'open': self.open_count,
+			         'idle': len( self.idle ),
+			         'max_handles': self.max_handles,
+			         'hits': self.hits,
+			         'misses': self.misses,
+			       }
+
+	# these expect the lock to be held
+	def closeOldest( self ):
+		idle_key, ( zf, last_used ) = self.idle.popitem( last=False )
+		self.open_count -= 1
+		zf.close()
+
+	def closeIdle( self, before ):
+		while len( self.idle ) > 0 and self.idle.itervalues().next()[1] < before:
+			self.closeOldest()
+
+zip_file_pool = ZipFilePool()
+
 class ZipArchiver:
 	
 	def __init__( self, path ):
 		self.path = path
+		self.member_info = None
+		self.member_info_stamp = None
 	
 	def getArchiveComment( self ):
-		zf = zipfile.ZipFile( self.path, 'r' )
-		comment = zf.comment
-		zf.close()
-		return comment
+		with zip_file_pool.open( self.path ) as zf:
+			return zf.comment
 
 	def setArchiveComment( self, comment ):
 		return self.writeZipComment( self.path, comment )
 
 	def readArchiveFile( self, archive_file ):
 		data = ""
-		zf = zipfile.ZipFile( self.path, 'r' )
 
 		try:
-			data = zf.read( archive_file )
+			with zip_file_pool.open( self.path ) as zf:
+				data = zf.read( archive_file )
 		except zipfile.BadZipfile as e:
 			print >> sys.stderr, u"bad zipfile [{0}]: {1} :: {2}".format(e, self.path, archive_file)
-			zf.close()	
 			raise IOError
 		except Exception as e:
-			zf.close()	
 			print >> sys.stderr, u"bad zipfile [{0}]: {1} :: {2}".format(e, self.path, archive_file)
 			raise IOError
-		finally:
-			zf.close()
 		return data
 
+	def getArchiveFileLocation( self, archive_file ):
+		# For a stored (uncompressed and unencrypted) member, returns the
+		# (offset, size) of its data within the zip file, so it can be read
+		# straight off the disk.  Returns None for anything else.
+		info = self.getArchiveMemberInfo().get( archive_file )
+		if info is None or info[0] is None:
+			return None
+		return ( info[0], info[2] )
+
+	def getArchiveMemberInfo( self ):
+		# Returns a dict of member name -> (data offset, compressed size,
+		# uncompressed size, compression method).  The offset is None unless
+		# the member is stored as is.  The info on all the members is found
+		# in one pass, and kept until the file changes
+		try:
+			statinfo = os.stat( self.path )
+		except OSError:
+			return dict()
+		stamp = ( statinfo.st_mtime, statinfo.st_size )
+		if self.member_info is None or self.member_info_stamp != stamp:
+			self.member_info = self.findMemberInfo()
+			self.member_info_stamp = stamp
+		return self.member_info
+
+	def findMemberInfo( self ):
+		member_info = dict()
+		try:
+			with zip_file_pool.open( self.path ) as zf:
+				for info in zf.infolist():
+					member_info[ info.filename ] = ( self.findDataOffset( zf, info ),
+					                  info.compress_size, info.file_size, info.compress_type )
+		except Exception as e:
+			print >> sys.stderr, u"Unable to locate zipfile members [{0}]: {1}".format(e, self.path)
+		return member_info
+
+	def findDataOffset( self, zf, info ):
+		if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+			return None
+		# the data starts after the local header, whose name and extra
+		# fields don't have to match the ones in the central directory
+		zf.fp.seek( info.header_offset )
+		header = zf.fp.read( zipfile.sizeFileHeader )
+		if len( header ) != zipfile.sizeFileHeader or header[0:4] != zipfile.stringFileHeader:
+			return None
+		fheader = struct.unpack( zipfile.structFileHeader, header )
+		return ( info.header_offset + zipfile.sizeFileHeader +
+		         fheader[zipfile._FH_FILENAME_LENGTH] + fheader[zipfile._FH_EXTRA_FIELD_LENGTH] )
+
+	def readArchiveFileHead( self, archive_file, length ):
+		# just the first length bytes of the member, which is all that's
+		# needed to peek at an image's header
+		try:
+			with zip_file_pool.open( self.path ) as zf:
+				member = zf.open( archive_file )
+				try:
+					return member.read( length )
+				finally:
+					member.close()
+		except Exception as e:
+			print >> sys.stderr, u"bad zipfile [{0}]: {1} :: {2}".format(e, self.path, archive_file)
+			raise IOError
+
 	def removeArchiveFile( self, archive_file ):
 		try:
 			self.rebuildZipFile(  [ archive_file ] )
@@ -110,13 +295,13 @@ class ZipArchiver:
 			return True
 		except:
 			return False
+		finally:
+			zip_file_pool.invalidate( self.path )
 			
 	def getArchiveFilenameList( self ):
 		try:
-			zf = zipfile.ZipFile( self.path, 'r' )
-			namelist = zf.namelist()
-			zf.close()
-			return namelist
+			with zip_file_pool.open( self.path ) as zf:
+				return zf.namelist()
 		except Exception as e:
 			print >> sys.stderr, u"Unable to get zipfile list [{0}]: {1}".format(e, self.path)
 			return []
@@ -127,6 +312,10 @@ class ZipArchiver:
 		# this recompresses the zip archive, without the files in the exclude_list
 		#print ">> sys.stderr, Rebuilding zip {0} without {1}".format( self.path, exclude_list )
 		
+		# pooled handles would keep the old file open (and on Windows,
+		# stop it from being removed)
+		zip_file_pool.invalidate( self.path )
+
 		# generate temp file
 		tmp_fd, tmp_name = tempfile.mkstemp( dir=os.path.dirname(self.path) )
 		os.close( tmp_fd )
@@ -159,6 +348,8 @@ class ZipArchiver:
 		see: http://en.wikipedia.org/wiki/Zip_(file_format)#Structure
 		"""
 
+		zip_file_pool.invalidate( filename )
+
 		#get file size
 		statinfo = os.stat(filename)
 		file_length = statinfo.st_size
@@ -214,6 +405,7 @@ class ZipArchiver:
 
 	def copyFromArchive( self, otherArchive ):
 		# Replace the current zip with one copied from another archive
+		zip_file_pool.invalidate( self.path )
 		try:		
 			zout = zipfile.ZipFile (self.path, 'w')
 			for fname in otherArchive.getArchiveFilenameList():
@@ -236,13 +428,64 @@ class ZipArchiver:
 		
 #------------------------------------------
 # RAR implementation
+
+RAR_TRIES = 3
+RAR_RETRY_DELAY = 0.1
+
+class RarListingCache:
+	"""
+	Keeps the RarFile object (whose creation runs unrar once) and its
+	listing (another run) for recently used archives, keyed by path and
+	checked against the file's modification time and size.
+	"""
+
+	def __init__( self, max_entries=64 ):
+		self.max_entries = max_entries
+		self.reset()
+
+	def reset( self ):
+		self.pid = os.getpid()
+		self.lock = threading.Lock()
+		self.entries = OrderedDict()	# path -> (stamp, (rarc, infolist)), oldest first
+
+	def get( self, path ):
+		try:
+			statinfo = os.stat( path )
+		except OSError:
+			return None
+		stamp = ( statinfo.st_mtime, statinfo.st_size )
+		if self.pid != os.getpid():
+			# forked, and the lock might have been held at the time
+			self.reset()
+		with self.lock:
+			entry = self.entries.pop( path, None )
+			if entry is None or entry[0] != stamp:
+				return None
+			self.entries[ path ] = entry
+			return entry[1]
+
+	def put( self, path, stamp, info ):
+		with self.lock:
+			self.entries.pop( path, None )
+			self.entries[ path ] = ( stamp, info )
+			while len( self.entries ) > self.max_entries:
+				self.entries.popitem( last=False )
+
+	def invalidate( self, path ):
+		with self.lock:
+			self.entries.pop( path, None )
+
+rar_listing_cache = RarListingCache()
 	
 class RarArchiver:
 	
 	devnull = None
-	def __init__( self, path, rar_exe_path ):
+	def __init__( self, path, rar_exe_path, extract_cache=None ):
 		self.path = path
 		self.rar_exe_path = rar_exe_path
+		# optional cache to extract the whole archive into, on first read.
+		# it needs a read( path, archive_file, extract_func ) method
+		self.extract_cache = extract_cache
 
 		if RarArchiver.devnull is None:
 			RarArchiver.devnull = open(os.devnull, "w")
@@ -279,6 +522,7 @@ class RarArchiver:
 				subprocess.call([self.rar_exe_path, 'c', '-w' + working_dir , '-c-', '-z' + tmp_name, self.path], 
 					startupinfo=self.startupinfo, 
 					stdout=RarArchiver.devnull)
+				rar_listing_cache.invalidate( self.path )
 				
 				if platform.system() == "Darwin":
 					time.sleep(1)
@@ -293,45 +537,76 @@ class RarArchiver:
 			
 	def readArchiveFile( self, archive_file ):
 
-		# Make sure to escape brackets, since some funky stuff is going on
-		# underneath with "fnmatch"
-		archive_file = archive_file.replace("[", '[[]')
-		entries = []
+		if self.extract_cache is not None:
+			data = self.extract_cache.read( self.path, archive_file, self.extractAll )
+			if data is not None:
+				return data
 
-		rarc = self.getRARObj()
+		data = self.readArchiveFiles( [ archive_file ] ).get( archive_file )
+		if data is None:
+			raise IOError
+		return data
 
-		tries = 0
-		while tries < 7:
-			try:
-				tries = tries+1
-				entries = rarc.read_files( archive_file )
+	def readArchiveFiles( self, archive_files ):
+		# Reads several members at once, returning a dict of name -> data.
+		# Where possible, they all come out of one unrar pipe, in archive
+		# order, and are split up by the sizes in the listing
+		if self.extract_cache is not None:
+			return dict( ( name, self.readArchiveFile( name ) ) for name in archive_files )
 
-				if entries[0][0].size != len(entries[0][1]):
-					print >> sys.stderr, u"readArchiveFile(): [file is not expected size: {0} vs {1}]  {2}:{3} [attempt # {4}]".format(
-								entries[0][0].size,len(entries[0][1]), self.path, archive_file, tries)
-					continue
-				
-			except (OSError, IOError) as e:
-				print >> sys.stderr, u"readArchiveFile(): [{0}]  {1}:{2} attempt#{3}".format(str(e), self.path, archive_file, tries)
-				time.sleep(1)
-			except Exception as e:
-				print >> sys.stderr, u"Unexpected exception in readArchiveFile(): [{0}] for {1}:{2} attempt#{3}".format(str(e), self.path, archive_file, tries)
-				break
+		try:
+			rarc, infolist = self.getRARInfo()
+		except Exception as e:
+			print >> sys.stderr, u"readArchiveFiles(): [{0}] {1}".format(str(e), self.path)
+			raise IOError
 
+		wanted = set( archive_files )
+		members = [ info for info in infolist if info.filename in wanted and not info.isdir ]
+
+		def readAll():
+			if hasattr( rarc, 'call' ):
+				return self.readMembersFromPipe( rarc, members )
 			else:
-				#Success"
-				#entries is a list of of tuples:  ( rarinfo, filedata)
-				if tries > 1:
-					print >> sys.stderr, u"Attempted read_files() {0} times".format(tries)
-				if (len(entries) == 1):
-					return entries[0][1]
-				else:
-					raise IOError
-			
-		raise IOError
-		
+				return self.readMembersOneByOne( rarc, members )
+
+		try:
+			return self.retry( readAll, "readArchiveFiles" )
+		except Exception as e:
+			print >> sys.stderr, u"Unexpected exception in readArchiveFiles(): [{0}] for {1}".format(str(e), self.path)
+			raise IOError
+
+	def readMembersFromPipe( self, rarc, members ):
+		entries = dict()
+		proc = rarc.call( 'p', ['inul'], [ info.filename for info in members ] )
+		try:
+			for info in sorted( members, key=lambda info: info.index ):
+				data = proc.stdout.read( info.size )
+				if len( data ) != info.size:
+					raise IOError( u"file is not expected size: {0} vs {1} {2}".format( info.size, len( data ), info.filename ) )
+				entries[ info.filename ] = data
+			# anything left over means the sizes didn't line up
+			if proc.stdout.read( 1 ) != "":
+				raise IOError( u"unexpected extra data" )
+		finally:
+			proc.stdout.close()
+			proc.wait()
+		return entries
+
+	def readMembersOneByOne( self, rarc, members ):
+		entries = dict()
+		for info in members:
+			# Make sure to escape brackets, since some funky stuff is going on
+			# underneath with "fnmatch"
+			found = rarc.read_files( info.filename.replace( "[", '[[]' ) )
+			if len( found ) != 1 or found[0][0].size != len( found[0][1] ):
+				raise IOError( u"file is not expected size: {0}".format( info.filename ) )
+			entries[ info.filename ] = found[0][1]
+		return entries
+
+	def extractAll( self, folder ):
+		rarc = self.getRARObj()
+		rarc.extract( '*', folder, withSubpath=True, overwrite=True )
 
-		
 	def writeArchiveFile( self, archive_file, data ):
 
 		if self.rar_exe_path is not None:
@@ -352,6 +627,7 @@ class RarArchiver:
 				subprocess.call([self.rar_exe_path, 'a', '-w' + working_dir ,'-c-', '-ep', self.path, tmp_file], 
 					startupinfo=self.startupinfo,
 					stdout=RarArchiver.devnull)
+				rar_listing_cache.invalidate( self.path )
 
 				if platform.system() == "Darwin":
 					time.sleep(1)
@@ -371,6 +647,7 @@ class RarArchiver:
 				subprocess.call([self.rar_exe_path, 'd','-c-', self.path, archive_file], 
 					startupinfo=self.startupinfo, 				   
 					stdout=RarArchiver.devnull)
+				rar_listing_cache.invalidate( self.path )
 
 				if platform.system() == "Darwin":
 					time.sleep(1)
@@ -383,47 +660,37 @@ class RarArchiver:
 			
 	def getArchiveFilenameList( self ):
 
-		rarc = self.getRARObj()
-		#namelist = [ item.filename for item in rarc.infolist() ]
-		#return namelist
-
-		tries = 0
-		while tries < 7:
-			try:
-				tries = tries+1
-				#namelist = [ item.filename for item in rarc.infolist() ]
-				namelist = []
-				for item in rarc.infolist():
-					if item.size != 0:
-						namelist.append( item.filename )
-			
-			except (OSError, IOError) as e:
-				print >> sys.stderr, u"getArchiveFilenameList(): [{0}] {1} attempt#{2}".format(str(e), self.path, tries)
-				time.sleep(1)
+		rarc, infolist = self.getRARInfo()
+		return [ info.filename for info in infolist if info.size != 0 ]
 
-			else:
-				#Success"
-				return namelist
-			
-		raise e
-			
-		
 	def getRARObj( self ):
-		tries = 0
-		while tries < 7:
-			try:
-				tries = tries+1
+		rarc, infolist = self.getRARInfo()
+		return rarc
+
+	def getRARInfo( self ):
+		# the RarFile and its listing, each of which costs a run of unrar.
+		# they are shared by all the archivers, until the file changes
+		info = rar_listing_cache.get( self.path )
+		if info is None:
+			statinfo = os.stat( self.path )
+			def load():
 				rarc = UnRAR2.RarFile( self.path )
-			
+				return rarc, rarc.infolist()
+			info = self.retry( load, "getRARInfo" )
+			rar_listing_cache.put( self.path, ( statinfo.st_mtime, statinfo.st_size ), info )
+		return info
+
+	def retry( self, func, what ):
+		# a few quick tries, as unrar can fail now and then when busy
+		for attempt in range( RAR_TRIES ):
+			try:
+				return func()
 			except (OSError, IOError) as e:
-				print >> sys.stderr, u"getRARObj(): [{0}] {1} attempt#{2}".format(str(e), self.path, tries)
-				time.sleep(1)
-
-			else:
-				#Success"
-				return rarc
-			
-		raise e
+				print >> sys.stderr, u"{0}(): [{1}] {2} attempt#{3}".format(what, str(e), self.path, attempt + 1)
+				last_error = e
+				if attempt + 1 < RAR_TRIES:
+					time.sleep( RAR_RETRY_DELAY * ( 2 ** attempt ) )
+		raise last_error
 		
 #------------------------------------------
 # Folder implementation
@@ -516,37 +783,31 @@ class ComicArchive:
 	class ArchiveType:
 		Zip, Rar, Folder, Unknown = range(4)
     
-	def __init__( self, path, rar_exe_path=None, default_image_path=None ):
+	def __init__( self, path, rar_exe_path=None, default_image_path=None, rar_extract_cache=None ):
 		self.path = path
 		
 		self.rar_exe_path = rar_exe_path
+		self.rar_extract_cache = rar_extract_cache
 		self.ci_xml_filename = 'ComicInfo.xml'
 		self.comet_default_filename = 'CoMet.xml'
 		self.resetCache()
 		self.default_image_path = default_image_path
 		
-		# Use file extension to decide which archive test we do first
-		ext = os.path.splitext(path)[1].lower()
-		
+		# Use the first few bytes of the file to decide which archive test
+		# to do.  The RAR test runs unrar, so it's only tried on files that
+		# look like RARs
 		self.archive_type =  self.ArchiveType.Unknown
 		self.archiver = UnknownArchiver( self.path )
 
-		if ext == ".cbr" or ext == ".rar":
+		if self.sniffArchiveType() == self.ArchiveType.Rar:
 			if self.rarTest(): 
 				self.archive_type =  self.ArchiveType.Rar
-				self.archiver = RarArchiver( self.path, rar_exe_path=self.rar_exe_path )
-				
-			elif self.zipTest():
-				self.archive_type =  self.ArchiveType.Zip
-				self.archiver = ZipArchiver( self.path )
-		else:
-			if self.zipTest():
-				self.archive_type =  self.ArchiveType.Zip
-				self.archiver = ZipArchiver( self.path )
+				self.archiver = RarArchiver( self.path, rar_exe_path=self.rar_exe_path, extract_cache=self.rar_extract_cache )
 				
-			elif self.rarTest(): 
-				self.archive_type =  self.ArchiveType.Rar
-				self.archiver = RarArchiver( self.path, rar_exe_path=self.rar_exe_path )
+		# (zips can have other stuff in front, so they get tested anyway)
+		elif self.zipTest():
+			self.archive_type =  self.ArchiveType.Zip
+			self.archiver = ZipArchiver( self.path )
 
 		if ComicArchive.logo_data is None:
 			#fname = ComicTaggerSettings.getGraphic('nocover.png')
@@ -574,12 +835,27 @@ class ComicArchive:
 		self.path = path
 		self.archiver.path = path
 
+	def sniffArchiveType( self ):
+		try:
+			with open( self.path, 'rb' ) as fd:
+				magic = fd.read( 8 )
+		except IOError:
+			return self.ArchiveType.Unknown
+
+		if magic.startswith( "PK\x03\x04" ) or magic.startswith( "PK\x05\x06" ):
+			return self.ArchiveType.Zip
+		# RAR 1.5-4.x, and RAR 5
+		if magic.startswith( "Rar!\x1a\x07\x00" ) or magic.startswith( "Rar!\x1a\x07\x01\x00" ):
+			return self.ArchiveType.Rar
+		return self.ArchiveType.Unknown
+
 	def zipTest( self ):
 		return zipfile.is_zipfile( self.path )
 
 	def rarTest( self ):
 		try:
-			rarc = UnRAR2.RarFile( self.path )
+			# this leaves the listing cached for the RarArchiver to use
+			RarArchiver( self.path, rar_exe_path=self.rar_exe_path ).getRARInfo()
 		except: # InvalidRARArchive:
 			return False
 		else:
@@ -692,6 +968,60 @@ class ComicArchive:
 
 		return image_data
 
+	def getPageLocation( self, index ):
+		# (offset, size) of the page's image data in the archive file, when
+		# it's stored there as is, otherwise None
+		if not self.isZip():
+			return None
+		filename = self.getPageName( index )
+		if filename is None:
+			return None
+		return self.archiver.getArchiveFileLocation( filename )
+
+	def getPages( self, index_list ):
+		# the image data of several pages.  for RARs, they're all read with
+		# one run of unrar, instead of one for each
+		name_list = [ self.getPageName( index ) for index in index_list ]
+		found = dict()
+		if self.isRar():
+			try:
+				found = self.archiver.readArchiveFiles( [ name for name in name_list if name is not None ] )
+			except IOError:
+				print >> sys.stderr, u"Error reading in pages.  Reading them one at a time."
+		return [ found[name] if name in found else self.getPage( index )
+		         for index, name in zip( index_list, name_list ) ]
+
+	def getPageInfoList( self ):
+		# For each page, in order, a tuple of (name, data offset, compressed
+		# size, uncompressed size, compression method).  Only zips have
+		# anything but the names, the rest is None otherwise
+		member_info = dict()
+		if self.isZip():
+			member_info = self.archiver.getArchiveMemberInfo()
+		info_list = []
+		for name in self.getPageNameList():
+			info_list.append( ( name, ) + member_info.get( name, ( None, None, None, None ) ) )
+		return info_list
+
+	def readPageHead( self, index, length ):
+		# the start of the page's image data.  cheap for zips, the other
+		# kinds have to read the whole page
+		filename = self.getPageName( index )
+		if filename is None:
+			return None
+		try:
+			if self.isZip():
+				return self.archiver.readArchiveFileHead( filename, length )
+			return self.archiver.readArchiveFile( filename )[:length]
+		except IOError:
+			return None
+
+	def setPageNameList( self, page_list ):
+		# primes the page list from a saved copy, to save listing and
+		# sorting the archive again
+		self.page_list = list( page_list )
+		self.page_count = len( self.page_list )
+
 	def getPageName( self, index ):
 		
 		if index is None:
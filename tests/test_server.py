@@ -0,0 +1,93 @@
+# coding=utf-8
+
+"""
+Tests for the image API handlers
+"""
+
+"""
+Copyright 2012-2014  Anthony Beville
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+	http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+
+import tornado.web
+import tornado.testing
+from concurrent.futures import ThreadPoolExecutor
+
+from comicstreamerlib.folders import AppFolders
+from comicstreamerlib import imageutils
+from comicstreamerlib.database import DataManager
+from comicstreamerlib.imageprocessor import ImageProcessor
+from comicstreamerlib.readahead import ReadAhead
+from comicstreamerlib.server import ComicPageAPIHandler, ThumbnailAPIHandler
+
+class ImageHandlerTest(tornado.testing.AsyncHTTPTestCase):
+    # just enough of an APIServer for the image handlers, with an empty
+    # library in a scratch home folder
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.old_home = os.environ.get('HOME')
+        os.environ['HOME'] = self.home
+        AppFolders.makeFolders()
+        super(ImageHandlerTest, self).setUp()
+
+    def tearDown(self):
+        super(ImageHandlerTest, self).tearDown()
+        self._app.archive_executor.shutdown()
+        self.dm.Session.remove()
+        if self.old_home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = self.old_home
+        shutil.rmtree(self.home)
+
+    def get_app(self):
+        app = tornado.web.Application([
+            (r"/comic/([0-9]+)/page/([0-9]+)/*", ComicPageAPIHandler),
+            (r"/comic/([0-9]+)/thumbnail/*", ThumbnailAPIHandler),
+        ])
+        app.config = { 'security': { 'use_api_key': False } }
+        app.imageprocessor = ImageProcessor(0, 0)
+        app.readahead = ReadAhead(0, 0, app.imageprocessor, None)
+        app.pagecache = None
+        app.archive_executor = ThreadPoolExecutor(1)
+        self.dm = app.dm = DataManager()
+        self.dm.create()
+        return app
+
+    def defaultImage(self):
+        with open(AppFolders.imagePath("default.jpg"), 'rb') as fd:
+            return fd.read()
+
+    def test_unknown_comic_page(self):
+        response = self.fetch("/comic/999/page/0")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.body, self.defaultImage())
+        # the stand-in mustn't be cached as if it were the page
+        self.assertNotIn("Last-Modified", response.headers)
+        self.assertNotIn("Cache-Control", response.headers)
+
+    def test_unknown_comic_resized_page(self):
+        response = self.fetch("/comic/999/page/0?max_height=100")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(imageutils.getImageType(response.body), "jpeg")
+
+    def test_unknown_comic_thumbnail(self):
+        response = self.fetch("/comic/999/thumbnail")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(imageutils.getImageType(response.body), "jpeg")